@@ -1,5 +1,10 @@
 from django.apps import AppConfig
+from django.core.signals import request_started
 
 
 class CoreConfig(AppConfig):
     name = 'core'
+
+    def ready(self):
+        from .cache import near_cache
+        request_started.connect(near_cache.reset_versions)
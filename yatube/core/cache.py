@@ -0,0 +1,353 @@
+import math
+import os
+import pickle
+import random
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS cache ('
+    ' key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL'
+    ') WITHOUT ROWID',
+    'CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires)',
+)
+ALIVE = '(expires IS NULL OR expires > ?)'
+# Больше параметров в одном запросе старые сборки SQLite не принимают.
+MAX_PARAMS = 900
+LOCK_POLL_INTERVAL = 0.05
+
+
+def _chunks(items, size=MAX_PARAMS):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class SQLiteCache(BaseCache):
+    """Кэш в файле SQLite в режиме WAL, общий для всех воркеров узла.
+
+    Читатели не ждут писателя, каждая операция атомарна, поэтому
+    add и incr можно звать из разных процессов одновременно.
+    Просроченные записи не отдаются; раз в OPTIONS['CULL_EVERY'] записей
+    процесс удаляет их из файла и, если записей больше MAX_ENTRIES,
+    вытесняет 1/CULL_FREQUENCY самых близких к истечению.
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        self._path = location
+        self._cull_every = int(params.get('OPTIONS', {}).get('CULL_EVERY',
+                                                             100))
+        self._writes = 0
+        self._local = threading.local()
+
+    def _db(self):
+        # Соединение своё у каждого потока и у каждого процесса после fork.
+        db = getattr(self._local, 'db', None)
+        if db is None or self._local.pid != os.getpid():
+            db = sqlite3.connect(self._path, timeout=30,
+                                 isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            for statement in SCHEMA:
+                db.execute(statement)
+            self._local.db, self._local.pid = db, os.getpid()
+        return db
+
+    @contextmanager
+    def _transaction(self):
+        """Транзакция, сразу берущая блокировку записи."""
+        db = self._db()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            yield db
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+
+    @contextmanager
+    def _write(self):
+        with self._transaction() as db:
+            yield db
+        self._writes += 1
+        if self._writes % self._cull_every == 0:
+            self._cull()
+
+    def _cull(self):
+        with self._transaction() as db:
+            db.execute('DELETE FROM cache WHERE expires <= ?', (time.time(),))
+            count = db.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+            if count <= self._max_entries:
+                return
+            if self._cull_frequency == 0:
+                db.execute('DELETE FROM cache')
+                return
+            db.execute(
+                'DELETE FROM cache WHERE key IN (SELECT key FROM cache '
+                'ORDER BY expires IS NULL, expires LIMIT ?)',
+                (count // self._cull_frequency,)
+            )
+
+    def _key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def get(self, key, default=None, version=None):
+        row = self._db().execute(
+            f'SELECT value FROM cache WHERE key = ? AND {ALIVE}',
+            (self._key(key, version), time.time())
+        ).fetchone()
+        return default if row is None else pickle.loads(row[0])
+
+    def get_many(self, keys, version=None):
+        keys = {self._key(key, version): key for key in keys}
+        found = {}
+        now = time.time()
+        for chunk in _chunks(list(keys)):
+            marks = ', '.join('?' * len(chunk))
+            found.update(
+                (keys[key], pickle.loads(value))
+                for key, value in self._db().execute(
+                    f'SELECT key, value FROM cache '
+                    f'WHERE key IN ({marks}) AND {ALIVE}',
+                    (*chunk, now)
+                )
+            )
+        return found
+
+    def _rows(self, data, timeout, version):
+        expires = self.get_backend_timeout(timeout)
+        return [
+            (self._key(key, version),
+             pickle.dumps(value, pickle.HIGHEST_PROTOCOL), expires)
+            for key, value in data.items()
+        ]
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.set_many({key: value}, timeout, version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        rows = self._rows(data, timeout, version)
+        with self._write() as db:
+            db.executemany(
+                'INSERT OR REPLACE INTO cache (key, value, expires) '
+                'VALUES (?, ?, ?)',
+                rows
+            )
+        return []
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        (row,) = self._rows({key: value}, timeout, version)
+        with self._write() as db:
+            db.execute(f'DELETE FROM cache WHERE key = ? AND NOT {ALIVE}',
+                       (row[0], time.time()))
+            return db.execute(
+                'INSERT OR IGNORE INTO cache (key, value, expires) '
+                'VALUES (?, ?, ?)',
+                row
+            ).rowcount == 1
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        with self._write() as db:
+            return db.execute(
+                f'UPDATE cache SET expires = ? WHERE key = ? AND {ALIVE}',
+                (self.get_backend_timeout(timeout), self._key(key, version),
+                 time.time())
+            ).rowcount == 1
+
+    def incr(self, key, delta=1, version=None):
+        key = self._key(key, version)
+        with self._write() as db:
+            row = db.execute(
+                f'SELECT value FROM cache WHERE key = ? AND {ALIVE}',
+                (key, time.time())
+            ).fetchone()
+            if row is None:
+                raise ValueError(f"Key '{key}' not found")
+            value = pickle.loads(row[0]) + delta
+            db.execute('UPDATE cache SET value = ? WHERE key = ?',
+                       (pickle.dumps(value, pickle.HIGHEST_PROTOCOL), key))
+        return value
+
+    def has_key(self, key, version=None):
+        return self._db().execute(
+            f'SELECT 1 FROM cache WHERE key = ? AND {ALIVE}',
+            (self._key(key, version), time.time())
+        ).fetchone() is not None
+
+    def delete(self, key, version=None):
+        self.delete_many([key], version)
+
+    def delete_many(self, keys, version=None):
+        keys = [self._key(key, version) for key in keys]
+        with self._write() as db:
+            for chunk in _chunks(keys):
+                marks = ', '.join('?' * len(chunk))
+                db.execute(f'DELETE FROM cache WHERE key IN ({marks})', chunk)
+
+    def clear(self):
+        with self._write() as db:
+            db.execute('DELETE FROM cache')
+
+
+class NearCache:
+    """Ограниченный LRU внутри процесса перед общим кэшем.
+
+    Значения лежат в пространствах имён. У каждого пространства в общем
+    кэше есть счётчик версии; bump() увеличивает его, и все значения
+    пространства перестают быть действительными во всех процессах.
+    Версии читаются из общего кэша один раз за запрос (и не реже раза
+    в NEAR_CACHE_VERSION_TTL секунд вне запросов), поэтому повторное
+    чтение горячего ключа не идёт дальше словаря процесса.
+    Отданные значения общие для потоков и их нельзя менять.
+    """
+
+    def __init__(self, alias=DEFAULT_CACHE_ALIAS):
+        self.alias = alias
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    @property
+    def shared(self):
+        return caches[self.alias]
+
+    def reset_versions(self, **kwargs):
+        """Забывает прочитанные версии; вызывается в начале запроса."""
+        self._versions = {}
+
+    @staticmethod
+    def _version_key(namespace):
+        return f'near_version:{namespace}'
+
+    def version(self, namespace):
+        now = time.monotonic()
+        known = self._versions.get(namespace)
+        if known is not None:
+            version, checked = known
+            if now - checked < settings.NEAR_CACHE_VERSION_TTL:
+                return version
+        key = self._version_key(namespace)
+        version = self.shared.get(key)
+        if version is None:
+            # Начальная версия — текущее время в микросекундах: после
+            # вытеснения счётчика старые значения не совпадут с новой.
+            self.shared.add(key, time.time_ns() // 1000, None)
+            version = self.shared.get(key)
+        self._versions[namespace] = (version, now)
+        return version
+
+    def bump(self, *namespaces):
+        """Делает недействительными все значения пространств имён."""
+        for namespace in namespaces:
+            key = self._version_key(namespace)
+            try:
+                version = self.shared.incr(key)
+            except ValueError:
+                version = time.time_ns() // 1000
+                self.shared.set(key, version, None)
+            self._versions[namespace] = (version, time.monotonic())
+
+    def _remember(self, entry_key, version, expires, value):
+        with self._lock:
+            self._entries[entry_key] = (version, expires, value)
+            self._entries.move_to_end(entry_key)
+            while len(self._entries) > settings.NEAR_CACHE_MAX_ENTRIES:
+                self._entries.popitem(last=False)
+
+    def get(self, namespace, key, default=None):
+        version = self.version(namespace)
+        entry_key = (namespace, key)
+        with self._lock:
+            entry = self._entries.get(entry_key)
+            if entry is not None:
+                self._entries.move_to_end(entry_key)
+        if entry is not None:
+            entry_version, expires, value = entry
+            if entry_version == version and (
+                    expires is None or expires > time.time()):
+                return value
+        stored = self.shared.get(f'near:{namespace}:{version}:{key}')
+        if stored is None:
+            return default
+        self._remember(entry_key, version, *stored)
+        return stored[1]
+
+    def set(self, namespace, key, value, timeout=DEFAULT_TIMEOUT):
+        version = self.version(namespace)
+        shared = self.shared
+        expires = shared.get_backend_timeout(timeout)
+        shared.set(f'near:{namespace}:{version}:{key}', (expires, value),
+                   timeout)
+        self._remember((namespace, key), version, expires, value)
+
+    def get_or_set(self, namespace, key, default, timeout=DEFAULT_TIMEOUT):
+        """Значение из кэша или результат default(), сохранённый в нём."""
+        value = self.get(namespace, key, self)
+        if value is self:
+            value = default()
+            self.set(namespace, key, value, timeout)
+        return value
+
+
+near_cache = NearCache()
+
+
+def _expiring(expires, delta):
+    # XFetch: чем дольше пересчёт и ближе срок, тем вероятнее начать
+    # его заранее; так воркеры не обнаруживают истечение одновременно.
+    if expires is None:
+        return False
+    early = -delta * settings.STALE_CACHE_BETA * math.log(
+        1 - random.random()
+    )
+    return time.time() + early >= expires
+
+
+def _wait(cache, key):
+    deadline = time.monotonic() + settings.STALE_CACHE_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(LOCK_POLL_INTERVAL)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry
+    return None
+
+
+def get_or_recompute(key, compute, timeout, cache=None):
+    """Значение из кэша; пересчитывает его только держатель блокировки.
+
+    Запись хранится на STALE_CACHE_GRACE секунд дольше timeout: пока
+    один процесс пересчитывает истёкшее значение, остальные отдают
+    старое. Без старого значения они недолго ждут нового и только
+    потом считают сами, ничего не сохраняя.
+    """
+    if cache is None:
+        cache = caches[DEFAULT_CACHE_ALIAS]
+    entry = cache.get(key)
+    if entry is not None and not _expiring(*entry[1:]):
+        return entry[0]
+    lock_key = f'lock:{key}'
+    if not cache.add(lock_key, os.getpid(), settings.STALE_CACHE_LOCK_TIMEOUT):
+        entry = entry or _wait(cache, key)
+        return compute() if entry is None else entry[0]
+    try:
+        started = time.monotonic()
+        value = compute()
+        delta = time.monotonic() - started
+        if timeout is None:
+            cache.set(key, (value, None, delta), None)
+        else:
+            cache.set(key, (value, time.time() + timeout, delta),
+                      timeout + settings.STALE_CACHE_GRACE)
+    finally:
+        cache.delete(lock_key)
+    return value
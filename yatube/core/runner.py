@@ -0,0 +1,30 @@
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class TestRunner(DiscoverRunner):
+    """Тесты чистят кэш, поэтому им нужен свой файл, а не кэш узла."""
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.cache_directory = tempfile.mkdtemp()
+        default = settings.CACHES['default']
+        self.cache_settings = override_settings(CACHES={
+            **settings.CACHES,
+            'default': {
+                **default,
+                'LOCATION': os.path.join(self.cache_directory,
+                                         'cache.sqlite3'),
+            },
+        })
+        self.cache_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.cache_settings.disable()
+        shutil.rmtree(self.cache_directory, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)
@@ -0,0 +1,65 @@
+from django.core.cache import InvalidCacheBackendError, caches
+from django.core.cache.utils import make_template_fragment_key
+from django.template import Library, TemplateSyntaxError, VariableDoesNotExist
+from django.templatetags.cache import CacheNode, do_cache
+from ..cache import get_or_recompute
+
+register = Library()
+
+
+def _resolve(var, context):
+    try:
+        return var.resolve(context)
+    except VariableDoesNotExist:
+        raise TemplateSyntaxError(
+            f'"cache" tag got an unknown variable: {var.var!r}'
+        )
+
+
+class StaleCacheNode(CacheNode):
+    """Фрагмент, который при истечении пересчитывает один запрос."""
+
+    def _cache(self, context):
+        if self.cache_name:
+            name = _resolve(self.cache_name, context)
+            try:
+                return caches[name]
+            except InvalidCacheBackendError:
+                raise TemplateSyntaxError(
+                    f'Invalid cache name specified for cache tag: {name!r}'
+                )
+        try:
+            return caches['template_fragments']
+        except InvalidCacheBackendError:
+            return caches['default']
+
+    def render(self, context):
+        expire_time = _resolve(self.expire_time_var, context)
+        if expire_time is not None:
+            try:
+                expire_time = int(expire_time)
+            except (ValueError, TypeError):
+                raise TemplateSyntaxError(
+                    '"cache" tag got a non-integer timeout value: '
+                    f'{expire_time!r}'
+                )
+        key = make_template_fragment_key(
+            self.fragment_name,
+            [var.resolve(context) for var in self.vary_on]
+        )
+        return get_or_recompute(
+            key, lambda: self.nodelist.render(context), expire_time,
+            self._cache(context)
+        )
+
+
+@register.tag('cache')
+def stale_cache(parser, token):
+    """{% cache %} со старым значением на время пересчёта.
+
+    Синтаксис тот же, что у встроенного тега, и ключи те же:
+    фрагмент сбрасывается через make_template_fragment_key.
+    """
+    node = do_cache(parser, token)
+    return StaleCacheNode(node.nodelist, node.expire_time_var,
+                          node.fragment_name, node.vary_on, node.cache_name)
@@ -0,0 +1,206 @@
+import multiprocessing
+import shutil
+import tempfile
+import os
+import time
+
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.template import Context, Template
+from django.test import SimpleTestCase, override_settings
+from ..cache import NearCache, SQLiteCache, get_or_recompute
+
+
+def _increment(location, times):
+    cache = SQLiteCache(location, {})
+    for _ in range(times):
+        cache.incr('hits')
+
+
+class SQLiteCacheTest(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.location = os.path.join(self.directory, 'cache.sqlite3')
+        self.cache = SQLiteCache(self.location, {})
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_basic_operations(self):
+        """get/set, get_many/set_many, add, delete и touch"""
+        self.cache.set('a', {'value': 1})
+        self.cache.set_many({'b': 2, 'c': [3]})
+        self.assertEqual(self.cache.get('a'), {'value': 1})
+        self.assertEqual(self.cache.get_many(['a', 'c', 'missing']),
+                         {'a': {'value': 1}, 'c': [3]})
+        self.assertFalse(self.cache.add('b', 20))
+        self.assertTrue(self.cache.add('d', 4))
+        self.cache.delete_many(['a', 'b'])
+        self.assertIsNone(self.cache.get('a'))
+        self.assertTrue(self.cache.touch('c', None))
+        self.assertFalse(self.cache.touch('a'))
+        self.assertEqual(self.cache.get_or_set('e', 5), 5)
+
+    def test_expired_entries(self):
+        """Просроченная запись не отдаётся, а ключ снова свободен для add"""
+        self.cache.set('gone', 1, 0.01)
+        time.sleep(0.02)
+        self.assertIsNone(self.cache.get('gone'))
+        self.assertNotIn('gone', self.cache)
+        with self.assertRaises(ValueError):
+            self.cache.incr('gone')
+        self.assertTrue(self.cache.add('gone', 2))
+
+    def test_cull(self):
+        """При переполнении вытесняются ближайшие к истечению записи"""
+        cache = SQLiteCache(self.location, {'OPTIONS': {
+            'MAX_ENTRIES': 4, 'CULL_FREQUENCY': 2, 'CULL_EVERY': 1
+        }})
+        for number in range(5):
+            cache.set(f'key{number}', number, 10 + number)
+        cache.set('forever', 'value', None)
+        self.assertEqual(cache.get('forever'), 'value')
+        self.assertLessEqual(len(cache.get_many(
+            [f'key{number}' for number in range(5)]
+        )), 4)
+        self.assertIsNone(cache.get('key0'))
+
+    def test_incr_is_atomic_across_processes(self):
+        """Процессы видят один кэш, и incr не теряет обновлений"""
+        self.cache.set('hits', 0)
+        workers = [
+            multiprocessing.Process(target=_increment,
+                                    args=(self.location, 50))
+            for _ in range(4)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(self.cache.get('hits'), 200)
+
+
+@override_settings(NEAR_CACHE_MAX_ENTRIES=2, NEAR_CACHE_VERSION_TTL=60)
+class NearCacheTest(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.shared = SQLiteCache(
+            os.path.join(self.directory, 'cache.sqlite3'), {}
+        )
+        self.near = NearCache()
+        self.other = NearCache()
+        # Два экземпляра над одним файлом — как два процесса узла.
+        patcher = mock.patch.object(NearCache, 'shared', self.shared)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_local_hit_skips_shared_cache(self):
+        """Повторное чтение берётся из памяти процесса"""
+        self.near.set('ns', 'key', 'value')
+        with mock.patch.object(self.shared, 'get') as shared_get:
+            self.assertEqual(self.near.get('ns', 'key'), 'value')
+        shared_get.assert_not_called()
+        self.assertEqual(self.other.get('ns', 'key'), 'value')
+
+    def test_version_check_does_not_write(self):
+        """Проверка известной версии не берёт блокировку записи"""
+        self.near.set('ns', 'key', 'value')
+        self.other.get('ns', 'key')
+        self.other.reset_versions()
+        with mock.patch.object(self.shared, '_transaction') as transaction:
+            self.assertEqual(self.other.get('ns', 'key'), 'value')
+        transaction.assert_not_called()
+
+    def test_bump_invalidates_other_processes(self):
+        """После bump() другой процесс не отдаёт старое значение"""
+        self.near.set('ns', 'key', 'old')
+        self.assertEqual(self.other.get('ns', 'key'), 'old')
+        self.near.bump('ns')
+        self.assertEqual(self.other.get('ns', 'key'), 'old')
+        self.other.reset_versions()
+        self.assertIsNone(self.other.get('ns', 'key'))
+        self.assertEqual(
+            self.other.get_or_set('ns', 'key', lambda: 'new'), 'new'
+        )
+        self.near.set('other', 'key', 'kept')
+        self.near.bump('ns')
+        self.assertEqual(self.near.get('other', 'key'), 'kept')
+
+    def test_lru_is_bounded(self):
+        """В памяти остаются только последние NEAR_CACHE_MAX_ENTRIES"""
+        for number in range(3):
+            self.near.set('ns', number, number)
+        self.assertEqual(len(self.near._entries), 2)
+        self.assertNotIn(('ns', 0), self.near._entries)
+        self.assertEqual(self.near.get('ns', 0), 0)
+
+
+@override_settings(STALE_CACHE_GRACE=60, STALE_CACHE_WAIT=0)
+class StaleWhileRevalidateTest(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = SQLiteCache(
+            os.path.join(self.directory, 'cache.sqlite3'), {}
+        )
+        self.calls = []
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def compute(self):
+        self.calls.append(len(self.calls) + 1)
+        return len(self.calls)
+
+    def get(self, timeout=10):
+        return get_or_recompute('key', self.compute, timeout, self.cache)
+
+    def expire(self):
+        value, expires, delta = self.cache.get('key')
+        self.cache.set('key', (value, time.time() - 1, delta))
+
+    def test_fresh_value_is_not_recomputed(self):
+        """Пока срок не вышел, значение берётся из кэша"""
+        self.assertEqual(self.get(), 1)
+        self.assertEqual(self.get(), 1)
+        self.assertEqual(self.calls, [1])
+
+    def test_stale_value_while_locked(self):
+        """Пока пересчитывает другой процесс, отдаётся старое значение"""
+        self.get()
+        self.expire()
+        self.cache.add('lock:key', 1)
+        self.assertEqual(self.get(), 1)
+        self.assertEqual(self.calls, [1])
+        self.cache.delete('lock:key')
+        self.assertEqual(self.get(), 2)
+        self.assertNotIn('lock:key', self.cache)
+
+    def test_early_expiration(self):
+        """Пересчёт может начаться раньше срока"""
+        self.get()
+        with mock.patch('core.cache.random.random', return_value=1 - 1e-9):
+            value, expires, _ = self.cache.get('key')
+            self.cache.set('key', (value, expires, 1))
+            self.assertEqual(self.get(), 2)
+
+    def test_template_tag(self):
+        """Тег cache совместим со встроенным по синтаксису и ключам"""
+        template = Template(
+            '{% load fragments %}'
+            '{% cache 60 fragment name %}{{ value }}{% endcache %}'
+        )
+        key = make_template_fragment_key('fragment', ['tag-test'])
+        self.addCleanup(cache.delete, key)
+        context = {'name': 'tag-test'}
+        self.assertEqual(template.render(Context({**context, 'value': 1})),
+                         '1')
+        self.assertEqual(template.render(Context({**context, 'value': 2})),
+                         '1')
+        cache.delete(key)
+        self.assertEqual(template.render(Context({**context, 'value': 3})),
+                         '3')
@@ -1,5 +1,106 @@
+from hashlib import md5
+
+from django import forms
 from django.contrib import admin
+from django.contrib.admin import helpers
+from django.contrib.admin.views.main import ORDER_VAR, ChangeList
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db.models.functions import Substr
+from django.http import QueryDict
+from django.shortcuts import render
+from django.utils.functional import cached_property
+from django.utils.text import Truncator
+from utils import FIRST_PAGE, KeysetPaginator
+from .caching import invalidate_authors
+from .constants import ADMIN_COUNT_CACHE_TIMEOUT, ADMIN_TEXT_LEN
+from .counters import move_posts
 from .models import Group, Post
+from .pagecache import post_rows, purge, purge_posts
+from .search import matching
+
+CURSOR_VARS = ('after', 'before', 'page')
+
+
+def cached_count(queryset):
+    """COUNT(*) запроса, закэшированный по его SQL на короткое время."""
+    sql, params = queryset.query.sql_with_params()
+    key = 'admin_count:' + md5(repr((sql, params)).encode()).hexdigest()
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, ADMIN_COUNT_CACHE_TIMEOUT)
+    return count
+
+
+def preview(queryset):
+    """Вместо полного текста постов выбирает только его начало."""
+    return queryset.defer('text').annotate(
+        text_preview=Substr('text', 1, ADMIN_TEXT_LEN + 1)
+    )
+
+
+class CachedCountPaginator(Paginator):
+    @cached_property
+    def count(self):
+        return cached_count(self.object_list)
+
+
+class PostChangeList(ChangeList):
+    """Список постов: без сортировки по столбцу листается по ключу.
+
+    Страницы открываются по курсору (дата, id) вместо OFFSET, а число
+    найденных постов берётся из кэша, а не считается на каждый запрос.
+    """
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        for key in CURSOR_VARS:
+            lookup_params.pop(key, None)
+        return lookup_params
+
+    def get_results(self, request):
+        cursor = {key: self.params.pop(key)
+                  for key in CURSOR_VARS if key in self.params}
+        self.keyset = ORDER_VAR not in self.params
+        if not self.keyset:
+            self.queryset = preview(self.queryset)
+            return super().get_results(request)
+        paginator = KeysetPaginator(
+            self.queryset.select_related(None).only('pub_date'),
+            self.list_per_page
+        )
+        page = paginator.get_page(cursor)
+        self.result_list = preview(self.queryset.filter(
+            pk__in=[post.pk for post in page.object_list]
+        ).order_by('-pub_date', '-id'))
+        self.result_count = cached_count(self.queryset)
+        self.show_full_result_count = False
+        self.show_admin_actions = True
+        self.full_result_count = None
+        self.can_show_all = False
+        self.multi_page = paginator.num_pages > 1
+        self.paginator = paginator
+        self.page_num = page.number - 1
+
+    def keyset_link(self, link):
+        if link == FIRST_PAGE:
+            return self.get_query_string()
+        return self.get_query_string(QueryDict(link[1:]).dict())
+
+    @property
+    def keyset_window(self):
+        """Тройки (номер, ссылка, разрыв) для шаблона пагинации."""
+        return [
+            (number, link and self.keyset_link(link), gap)
+            for number, link, gap in self.paginator.window_links
+        ]
+
+
+class MoveToGroupForm(forms.Form):
+    group = forms.ModelChoiceField(
+        queryset=Group.objects.all(), label='Группа'
+    )
 
 
 class PostAdmin(admin.ModelAdmin):
@@ -11,9 +112,69 @@ class PostAdmin(admin.ModelAdmin):
         'group',
         'image')
     list_editable = ('group', 'image')
+    list_select_related = ('author', 'group')
     search_fields = ('text',)
     list_filter = ('pub_date',)
     empty_value_display = '-пусто-'
+    show_full_result_count = False
+    paginator = CachedCountPaginator
+    actions = ('move_to_group',)
+
+    def get_changelist(self, request, **kwargs):
+        return PostChangeList
+
+    def get_list_display(self, request):
+        # Вместо полного текста в списке показывается его начало.
+        return tuple(
+            'short_text' if name == 'text' else name
+            for name in super().get_list_display(request)
+        )
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        return matching(queryset, search_term), False
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        field = super().formfield_for_foreignkey(db_field, request, **kwargs)
+        if db_field.name == 'group':
+            # Список групп выбирается один раз, а не для каждой строки.
+            field.choices = [choice for choice in field.choices]
+        return field
+
+    def short_text(self, post):
+        text = getattr(post, 'text_preview', None)
+        if text is None:
+            text = post.text
+        return Truncator(text).chars(ADMIN_TEXT_LEN)
+    short_text.short_description = 'Текст'
+
+    def move_to_group(self, request, queryset):
+        form = MoveToGroupForm(request.POST if 'apply' in request.POST
+                               else None)
+        if form.is_valid():
+            authors = list(queryset.order_by().values_list(
+                'author', flat=True
+            ).distinct())
+            rows = list(post_rows(queryset))
+            group = form.cleaned_data['group']
+            moved = move_posts(queryset, group.pk)
+            invalidate_authors(*authors)
+            purge_posts(rows)
+            purge(f'group:{group.slug}')
+            self.message_user(request, f'Перенесено постов: {moved}')
+            return None
+        return render(request, 'admin/posts/post/move_to_group.html', {
+            **self.admin_site.each_context(request),
+            'title': 'Перенос постов в группу',
+            'opts': self.model._meta,
+            'form': form,
+            'count': queryset.count(),
+            'selected': request.POST.getlist(helpers.ACTION_CHECKBOX_NAME),
+            'select_across': request.POST.get('select_across', '0'),
+            'action_checkbox_name': helpers.ACTION_CHECKBOX_NAME,
+        })
+    move_to_group.short_description = 'Перенести в группу'
 
 
 admin.site.register(Post, PostAdmin)
@@ -0,0 +1,166 @@
+from functools import wraps
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import Http404, JsonResponse
+from django.shortcuts import get_object_or_404
+from django.utils.http import urlencode
+from django.views.decorators.http import require_GET
+from utils import decode_cursor, encode_cursor, older
+from . import feeds
+from .constants import API_MAX_LIMIT, COMMENTS_PER_PAGE, PER_PAGE
+from .models import Group, Post
+from .profiles import profile_summary
+from .timeline import follow_feed
+
+POST_FIELDS = {
+    'id': 'id',
+    'text': 'text',
+    'pub_date': 'pub_date',
+    'author': 'author__username',
+    'group': 'group__slug',
+    'image': 'image',
+    'comments_count': 'comments_count',
+}
+COMMENT_FIELDS = {
+    'id': 'id',
+    'text': 'text',
+    'created': 'created',
+    'author': 'author__username',
+}
+IMAGE_STORAGE = Post._meta.get_field('image').storage
+
+
+class ApiError(Exception):
+    def __init__(self, detail, status=400):
+        super().__init__(detail)
+        self.detail = detail
+        self.status = status
+
+
+def _response(data, status=200):
+    return JsonResponse(data, status=status, encoder=DjangoJSONEncoder,
+                        json_dumps_params={'ensure_ascii': False,
+                                           'separators': (',', ':')})
+
+
+def api_view(view):
+    """Только GET; ошибки отдаются в JSON, а не HTML-страницей."""
+    @require_GET
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        try:
+            return _response(view(request, *args, **kwargs))
+        except ApiError as error:
+            return _response({'detail': error.detail}, error.status)
+        except Http404:
+            return _response({'detail': 'Не найдено'}, 404)
+    return wrapper
+
+
+def _fields(request, available):
+    """Поля из ?fields=a,b; без параметра отдаются все."""
+    names = [name for name in request.GET.get('fields', '').split(',')
+             if name]
+    if not names:
+        return available
+    unknown = sorted(set(names) - set(available))
+    if unknown:
+        raise ApiError('Неизвестные поля: ' + ', '.join(unknown))
+    return {name: available[name] for name in names}
+
+
+def _limit(request, default):
+    try:
+        limit = int(request.GET.get('limit', default))
+    except ValueError:
+        raise ApiError('limit должен быть числом')
+    return min(max(limit, 1), API_MAX_LIMIT)
+
+
+def _serialize(rows, fields):
+    """Собирает ответ прямо из строк .values(), без экземпляров моделей."""
+    items = [{name: row[lookup] for name, lookup in fields.items()}
+             for row in rows]
+    if 'image' in fields:
+        for item in items:
+            item['image'] = item['image'] and IMAGE_STORAGE.url(item['image'])
+    return items
+
+
+def _page(request, queryset, fields, date_field='pub_date', id_field='id',
+          per_page=PER_PAGE):
+    """Страница выдачи по курсору ?after= и ссылка на следующую."""
+    limit = _limit(request, per_page)
+    queryset = queryset.order_by(f'-{date_field}', f'-{id_field}')
+    after = decode_cursor(request.GET.get('after'))
+    if after is not None:
+        queryset = older(queryset, after, date_field, id_field)
+    lookups = {*fields.values(), date_field, id_field}
+    rows = list(queryset.values(*lookups)[:limit + 1])
+    next_link = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_link = request.path + '?' + urlencode({
+            **request.GET.dict(),
+            'after': encode_cursor(last[date_field], last[id_field])
+        })
+    return {'results': _serialize(rows, fields), 'next': next_link}
+
+
+@api_view
+def index(request):
+    return _page(request, feeds.index_posts(),
+                 _fields(request, POST_FIELDS))
+
+
+@api_view
+def group_posts(request, slug):
+    group = get_object_or_404(Group, slug=slug)
+    page = _page(request, feeds.group_posts(group),
+                 _fields(request, POST_FIELDS))
+    page['group'] = {
+        'title': group.title,
+        'slug': group.slug,
+        'description': group.description,
+        'posts_count': group.posts_count,
+    }
+    return page
+
+
+@api_view
+def profile(request, username):
+    summary = profile_summary(username, request.user)
+    page = _page(request, feeds.author_posts(summary.author),
+                 _fields(request, POST_FIELDS))
+    page['author'] = {
+        'username': summary.author.username,
+        'full_name': summary.author.get_full_name(),
+        'posts_count': summary.counters.posts_count,
+        'followers_count': summary.counters.followers_count,
+        'following_count': summary.counters.following_count,
+        'following': summary.following,
+    }
+    return page
+
+
+@api_view
+def follow_index(request):
+    if not request.user.is_authenticated:
+        raise ApiError('Нужна авторизация', 401)
+    return _page(request, follow_feed(request.user),
+                 _fields(request, POST_FIELDS), 'feed_date', 'feed_post')
+
+
+@api_view
+def post_detail(request, post_id):
+    fields = _fields(request, POST_FIELDS)
+    row = get_object_or_404(
+        Post.objects.values(*set(fields.values())), pk=post_id
+    )
+    post = _serialize([row], fields)[0]
+    post['comments'] = _page(
+        request, feeds.post_comments(post_id), COMMENT_FIELDS,
+        'created', per_page=COMMENTS_PER_PAGE
+    )
+    return post
@@ -0,0 +1,54 @@
+import logging
+
+from django.core.exceptions import SuspiciousFileOperation
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from sorl.thumbnail import delete
+from .models import MediaBlob
+from .thumbnails import source_file
+
+logger = logging.getLogger(__name__)
+
+
+def acquire(name, refs=1):
+    """Учитывает ещё refs ссылок постов на файл."""
+    if not name:
+        return
+    if MediaBlob.objects.filter(name=name).update(refs=F('refs') + refs):
+        return
+    try:
+        with transaction.atomic():
+            MediaBlob.objects.create(name=name, refs=refs)
+    except IntegrityError:
+        MediaBlob.objects.filter(name=name).update(refs=F('refs') + refs)
+
+
+def release(name):
+    """Снимает ссылку на файл; последний удаляет файл и его миниатюры."""
+    if not name:
+        return
+    MediaBlob.objects.filter(name=name, refs__gt=0).update(
+        refs=F('refs') - 1
+    )
+    if MediaBlob.objects.filter(name=name, refs=0).delete()[0]:
+        transaction.on_commit(lambda: delete_unused(name))
+
+
+def move(renames):
+    """Переносит счётчики ссылок со старых имён файлов на новые."""
+    blobs = MediaBlob.objects.filter(name__in=renames)
+    refs = dict(blobs.values_list('name', 'refs'))
+    blobs.delete()
+    for old, new in renames.items():
+        if refs.get(old):
+            acquire(new, refs[old])
+
+
+def delete_unused(name):
+    """Удаляет файл и его миниатюры, если на него больше нет ссылок."""
+    if MediaBlob.objects.filter(name=name).exists():
+        return
+    try:
+        delete(source_file(name))
+    except (OSError, SuspiciousFileOperation):
+        logger.warning('Не удалось удалить файл %s', name, exc_info=True)
@@ -0,0 +1,87 @@
+from uuid import uuid4
+
+from django.core.cache import cache
+from core.cache import near_cache
+from .constants import GROUP_CACHE_TIMEOUT
+from .models import Follow, Group, PulledAuthor
+
+GROUPS = 'groups'
+
+
+def _key(*parts):
+    return 'feed_version:' + ':'.join(str(part) for part in parts)
+
+
+def feed_version(*parts):
+    """Текущая версия ленты; входит в ключ закэшированного фрагмента."""
+    return cache.get_or_set(_key(*parts), uuid4().hex, None)
+
+
+def follow_feed_version(user):
+    """Версия ленты подписок: личная версия и версия «подтягиваемых»."""
+    keys = (_key('follow', user.pk), _key('follow', 'pulled'))
+    versions = cache.get_many(keys)
+    missing = {key: uuid4().hex for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, None)
+        versions.update(missing)
+    return '-'.join(versions[key] for key in keys)
+
+
+def index_feed_version(user):
+    """Версия главной; у вошедших карточки зависят от их подписок."""
+    version = feed_version('index')
+    if user.is_authenticated:
+        version = f'{version}-{user.pk}-{follow_feed_version(user)}'
+    return version
+
+
+def invalidate_index():
+    """Сбрасывает только главную: ленты подписок это не затрагивает."""
+    cache.set(_key('index'), uuid4().hex, None)
+
+
+def invalidate_post(post):
+    """Сбрасывает ленты, в которых показывается пост."""
+    invalidate_authors(post.author_id)
+
+
+def invalidate_authors(*author_ids):
+    """Сбрасывает главную и ленты подписчиков авторов."""
+    token = uuid4().hex
+    versions = {_key('index'): token}
+    author_ids = [pk for pk in author_ids if pk is not None]
+    pulled = PulledAuthor.objects.filter(author_id__in=author_ids)
+    if pulled.exists():
+        versions[_key('follow', 'pulled')] = token
+    followers = Follow.objects.filter(author_id__in=author_ids).exclude(
+        author_id__in=pulled.values('author_id')
+    ).order_by().values_list('user', flat=True).distinct()
+    for user_id in followers:
+        versions[_key('follow', user_id)] = token
+    cache.set_many(versions, None)
+
+
+def invalidate_follow(user_id):
+    """Сбрасывает ленту подписок читателя."""
+    cache.set(_key('follow', user_id), uuid4().hex, None)
+
+
+def group_choices():
+    """Варианты выбора группы для формы поста."""
+    return near_cache.get_or_set(GROUPS, 'choices', lambda: [
+        ('', '---------'), *Group.objects.values_list('pk', 'title')
+    ], GROUP_CACHE_TIMEOUT)
+
+
+def group_by_slug(slug):
+    """Группа для шапки её страницы; None, если такой нет."""
+    return near_cache.get_or_set(
+        GROUPS, f'slug:{slug}',
+        lambda: Group.objects.filter(slug=slug).first(),
+        GROUP_CACHE_TIMEOUT
+    )
+
+
+def invalidate_groups():
+    near_cache.bump(GROUPS)
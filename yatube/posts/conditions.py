@@ -0,0 +1,72 @@
+import hashlib
+
+from django.conf import settings
+from django.shortcuts import get_object_or_404
+from .caching import follow_feed_version, index_feed_version
+from .models import Group, Post
+from .profiles import profile_summary
+
+
+def _etag(request, *parts):
+    """ETag из состояния данных страницы и того, кто её смотрит."""
+    user = request.user
+    if user.is_authenticated:
+        # В странице вошедшего есть CSRF-токен и отметки подписок.
+        parts += (user.pk,
+                  request.COOKIES.get(settings.CSRF_COOKIE_NAME, ''),
+                  follow_feed_version(user))
+    return hashlib.md5(repr(parts).encode()).hexdigest()
+
+
+def _last_modified(posts):
+    # Читается одной записью из индекса (..., modified).
+    return posts.order_by('-modified').values_list(
+        'modified', flat=True
+    ).first()
+
+
+def index_etag(request):
+    return _etag(request, index_feed_version(request.user),
+                 _last_modified(Post.objects.all()))
+
+
+def group_etag(request, slug):
+    # Шапка страницы — название и описание группы — тоже входит в ETag.
+    group_id, *header = get_object_or_404(
+        Group.objects.values_list('pk', 'posts_count', 'title',
+                                  'description'),
+        slug=slug
+    )
+    return _etag(request, *header,
+                 _last_modified(Post.objects.filter(group_id=group_id)))
+
+
+def profile_etag(request, username):
+    summary = profile_summary(username, request.user)
+    counters = summary.counters
+    return _etag(request, counters.posts_count, counters.followers_count,
+                 counters.following_count, summary.following,
+                 _last_modified(Post.objects.filter(author=summary.author)))
+
+
+def _post_state(request, post_id):
+    # condition() спрашивает ETag и Last-Modified по отдельности.
+    if getattr(request, '_post_state', None) is None:
+        request._post_state = get_object_or_404(
+            Post.objects.values_list(
+                'modified', 'comments_count',
+                'author__counters__posts_count',
+                'author__counters__followers_count',
+                'author__counters__following_count'
+            ),
+            pk=post_id
+        )
+    return request._post_state
+
+
+def post_etag(request, post_id):
+    return _etag(request, *_post_state(request, post_id))
+
+
+def post_last_modified(request, post_id):
+    return _post_state(request, post_id)[0]
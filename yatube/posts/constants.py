@@ -1,3 +1,30 @@
 PER_PAGE = 10
 TITLE_LEN = 30
 TEXT_LEN = 15
+PAGE_WINDOW = 2
+MAX_OFFSET_PAGE = 10
+FEED_CACHE_TIMEOUT = 60 * 15
+COMMENTS_PER_PAGE = 20
+PROFILE_CACHE_TIMEOUT = 60 * 60
+FOLLOWING_CACHE_TIMEOUT = 60 * 60
+THUMBNAIL_WIDTHS = (320, 640, 960)
+THUMBNAIL_RATIO = 339 / 960
+THUMBNAIL_FORMATS = ('WEBP', 'JPEG')
+THUMBNAIL_OPTIONS = {
+    'crop': 'center', 'upscale': True, 'quality': 80, 'progressive': True
+}
+THUMBNAIL_JOB_ATTEMPTS = 3
+THUMBNAIL_JOB_LEASE = 60 * 5
+# Пауза перед повтором упавшего задания; удваивается с каждой попыткой.
+THUMBNAIL_JOB_BACKOFF = 30
+IMAGE_PLACEHOLDER_SIZE = 16
+MAX_IMAGE_PIXELS = 50_000_000
+# Без draft() картинка декодируется целиком: ~48 МБ в RGBA.
+MAX_DECODED_PIXELS = 12_000_000
+MAX_IMAGE_SIDE = 2560
+SEARCH_MAX_TERMS = 10
+ADMIN_TEXT_LEN = 50
+ADMIN_COUNT_CACHE_TIMEOUT = 60
+API_MAX_LIMIT = 100
+PAGE_CACHE_TIMEOUT = 60 * 60 * 24
+GROUP_CACHE_TIMEOUT = 60 * 60
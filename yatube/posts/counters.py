@@ -0,0 +1,85 @@
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from .models import Comment, Follow, Group, Post, User, UserCounters
+
+
+def _change(queryset, field, delta, **values):
+    if delta < 0:
+        queryset = queryset.filter(**{f'{field}__gte': -delta})
+    return queryset.update(**{field: F(field) + delta}, **values)
+
+
+def change_user(user_id, field, delta):
+    """Атомарно меняет счётчик пользователя, создавая строку при нужде."""
+    if user_id is None:
+        return
+    counters = UserCounters.objects.filter(user_id=user_id)
+    if not _change(counters, field, delta) and delta > 0:
+        UserCounters.objects.get_or_create(user_id=user_id)
+        _change(counters, field, delta)
+
+
+def change_group(group_id, delta):
+    if group_id is not None:
+        _change(Group.objects.filter(pk=group_id), 'posts_count', delta)
+
+
+def change_post(post_id, delta):
+    """Меняет число комментариев; пост при этом считается изменённым."""
+    _change(Post.objects.filter(pk=post_id), 'comments_count', delta,
+            modified=timezone.now())
+
+
+def move_post(old_group_id, new_group_id):
+    """Переносит пост в счётчиках при смене группы."""
+    if old_group_id != new_group_id:
+        change_group(old_group_id, -1)
+        change_group(new_group_id, 1)
+
+
+def move_posts(posts, group_id):
+    """Переносит посты в группу одним UPDATE и правит счётчики групп."""
+    posts = posts.exclude(group_id=group_id).order_by()
+    with transaction.atomic():
+        moved = list(posts.values_list('group').annotate(total=Count('pk')))
+        updated = posts.update(group_id=group_id, modified=timezone.now())
+        for old_group_id, total in moved:
+            change_group(old_group_id, -total)
+        change_group(group_id, updated)
+    return updated
+
+
+def user_counters(user):
+    """Счётчики пользователя; без строки в БД все они равны нулю."""
+    if user is None:
+        return UserCounters()
+    try:
+        return user.counters
+    except UserCounters.DoesNotExist:
+        return UserCounters(user=user)
+
+
+def _count(queryset, field):
+    return Coalesce(Subquery(
+        queryset.filter(**{field: OuterRef('pk')}).order_by()
+        .values(field).annotate(total=Count('pk')).values('total')
+    ), Value(0))
+
+
+def recount():
+    """Пересчитывает все счётчики по данным таблиц."""
+    UserCounters.objects.bulk_create(
+        (UserCounters(user_id=pk)
+         for pk in User.objects.values_list('pk', flat=True).iterator()),
+        batch_size=500,
+        ignore_conflicts=True
+    )
+    Group.objects.update(posts_count=_count(Post.objects, 'group'))
+    Post.objects.update(comments_count=_count(Comment.objects, 'post'))
+    UserCounters.objects.update(
+        posts_count=_count(Post.objects, 'author'),
+        followers_count=_count(Follow.objects, 'author'),
+        following_count=_count(Follow.objects, 'user')
+    )
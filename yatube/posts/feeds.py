@@ -0,0 +1,21 @@
+from .models import Comment, Post
+
+
+def index_posts():
+    """Посты главной страницы."""
+    return Post.objects.select_related('group', 'author')
+
+
+def group_posts(group):
+    """Посты группы; читаются по индексу (group, pub_date, id)."""
+    return group.posts.select_related('author', 'group')
+
+
+def author_posts(author):
+    """Посты автора; читаются по индексу (author, pub_date, id)."""
+    return author.posts.select_related('author', 'group')
+
+
+def post_comments(post_id):
+    """Комментарии к посту."""
+    return Comment.objects.select_related('author').filter(post_id=post_id)
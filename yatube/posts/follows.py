@@ -0,0 +1,37 @@
+from django.core.cache import cache
+from django.db import transaction
+from .constants import FOLLOWING_CACHE_TIMEOUT
+from .models import Follow
+
+
+def _key(user_id):
+    return f'following:{user_id}'
+
+
+def following_ids(user):
+    """Множество id авторов, на которых подписан пользователь."""
+    if not user.is_authenticated:
+        return frozenset()
+    ids = cache.get(_key(user.pk))
+    if ids is None:
+        ids = frozenset(Follow.objects.filter(user=user).values_list(
+            'author', flat=True
+        ))
+        cache.set(_key(user.pk), ids, FOLLOWING_CACHE_TIMEOUT)
+    return ids
+
+
+def followed_among(user, author_ids):
+    """Отвечает, на кого из авторов author_ids подписан пользователь."""
+    return following_ids(user).intersection(author_ids)
+
+
+def forget_following(user_id):
+    """Сбрасывает закэшированное множество подписок пользователя.
+
+    Ключ удаляется сразу и ещё раз после коммита: читатель, успевший
+    до коммита закэшировать старое множество, не оставит его в кэше.
+    """
+    key = _key(user_id)
+    cache.delete(key)
+    transaction.on_commit(lambda: cache.delete(key))
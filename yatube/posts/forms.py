@@ -1,5 +1,8 @@
 from django import forms
+from .caching import group_choices
 from .models import Post, Comment
+from .thumbnails import image_placeholder
+from .uploads import normalize_image
 
 
 class PostForm(forms.ModelForm):
@@ -7,6 +10,25 @@ class PostForm(forms.ModelForm):
     class Meta:
         model = Post
         fields = ('text', 'group', 'image')
+        error_messages = {
+            'image': {
+                'empty': 'Файл пустой или больше допустимого размера.',
+            },
+        }
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['group'].choices = group_choices()
+
+    def clean_image(self):
+        image = self.cleaned_data['image']
+        if 'image' in self.changed_data:
+            if image:
+                image = normalize_image(image)
+            self.instance.image_placeholder = (
+                image_placeholder(image) if image else ''
+            )
+        return image
 
 
 class CommentForm(forms.ModelForm):
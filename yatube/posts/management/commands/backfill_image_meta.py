@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from posts.models import Post
+from posts.thumbnails import image_placeholder
+
+
+class Command(BaseCommand):
+    help = 'Заполняет размеры и превью картинок у старых постов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch', type=int, default=500,
+            help='Сколько постов обновлять за раз'
+        )
+
+    def handle(self, *args, **options):
+        posts = Post.objects.exclude(image='').filter(
+            Q(image_width__isnull=True) | Q(image_placeholder='')
+        ).only('pk', 'image').order_by('pk')
+        done = failed = last = 0
+        while True:
+            batch = list(posts.filter(pk__gt=last)[:options['batch']])
+            if not batch:
+                break
+            last = batch[-1].pk
+            ready = []
+            for post in batch:
+                try:
+                    with post.image.open('rb') as file_:
+                        post.image_placeholder = image_placeholder(file_)
+                        post.image_width = post.image.width
+                        post.image_height = post.image.height
+                except (OSError, ValueError):
+                    failed += 1
+                    continue
+                ready.append(post)
+            Post.objects.bulk_update(
+                ready, ('image_width', 'image_height', 'image_placeholder')
+            )
+            done += len(ready)
+        self.stdout.write(self.style.SUCCESS(
+            f'Обновлено постов: {done}, ошибок: {failed}'
+        ))
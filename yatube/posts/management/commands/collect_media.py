@@ -0,0 +1,114 @@
+import os
+import posixpath
+import time
+from datetime import timedelta
+from itertools import islice
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from posts import blobs
+from posts.models import MediaBlob, Post
+from posts.thumbnails import known_thumbnails
+from sorl.thumbnail import default
+from sorl.thumbnail.conf import settings as thumbnail_settings
+
+
+def walk(storage, directory):
+    """Имена файлов каталога и его подкаталогов, лениво.
+
+    os.scandir читает каталог порциями, поэтому даже плоский каталог
+    со всеми файлами не загружается в память целиком.
+    """
+    with os.scandir(storage.path(directory)) as entries:
+        for entry in entries:
+            name = posixpath.join(directory, entry.name)
+            if entry.is_dir(follow_symlinks=False):
+                yield from walk(storage, name)
+            elif entry.is_file(follow_symlinks=False):
+                yield name
+
+
+def batches(names, size):
+    while True:
+        batch = list(islice(names, size))
+        if not batch:
+            return
+        yield batch
+
+
+class Command(BaseCommand):
+    help = 'Удаляет картинки и миниатюры, на которые не ссылаются посты'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только показать, что будет удалено'
+        )
+        parser.add_argument(
+            '--rate', type=float, default=0,
+            help='Не больше стольких удалений в секунду (0 — без паузы)'
+        )
+        parser.add_argument(
+            '--batch', type=int, default=500,
+            help='Сколько файлов сверять с базой за раз'
+        )
+        parser.add_argument(
+            '--min-age', type=int, default=60 * 60,
+            help='Не трогать файлы моложе стольких секунд'
+        )
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.deleted = 0
+        self.cutoff = timezone.now() - timedelta(seconds=options['min_age'])
+        field = Post._meta.get_field('image')
+        self.collect(field.storage, field.upload_to,
+                     self.orphan_originals, self.delete_original)
+        self.collect(default.storage, thumbnail_settings.THUMBNAIL_PREFIX,
+                     self.orphan_thumbnails, default.storage.delete)
+        verb = 'Будет удалено' if options['dry_run'] else 'Удалено'
+        self.stdout.write(self.style.SUCCESS(f'{verb} файлов: {self.deleted}'))
+
+    def collect(self, storage, directory, find_orphans, delete):
+        directory = directory.rstrip('/')
+        if not storage.exists(directory):
+            return
+        for batch in batches(walk(storage, directory), self.options['batch']):
+            old = [name for name in batch
+                   if storage.get_modified_time(name) < self.cutoff]
+            for name in find_orphans(old):
+                if self.options['dry_run']:
+                    self.stdout.write(name)
+                    self.deleted += 1
+                    continue
+                if delete(name) is False:
+                    continue
+                self.stdout.write(name)
+                self.deleted += 1
+                if self.options['rate']:
+                    time.sleep(1 / self.options['rate'])
+
+    @staticmethod
+    def orphan_originals(names):
+        referenced = set(Post.objects.filter(
+            image__in=names
+        ).values_list('image', flat=True))
+        return [name for name in names if name not in referenced]
+
+    @staticmethod
+    def orphan_thumbnails(names):
+        known = known_thumbnails(names)
+        return [name for name in names if name not in known]
+
+    def delete_original(self, name):
+        """Удаляет картинку, если за время обхода на неё не сослались."""
+        storage = Post._meta.get_field('image').storage
+        with transaction.atomic():
+            MediaBlob.objects.filter(name=name, refs__lte=0).delete()
+            if (MediaBlob.objects.filter(name=name).exists()
+                    or Post.objects.filter(image=name).exists()
+                    or storage.get_modified_time(name) >= self.cutoff):
+                return False
+            blobs.delete_unused(name)
+        return True
@@ -0,0 +1,85 @@
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Case, CharField, Value, When
+from django.utils import timezone
+from posts import blobs
+from posts.caching import invalidate_authors
+from posts.models import Post
+from posts.pagecache import post_rows, purge_posts
+from posts.storage import SHARD_DEPTH
+from posts.thumbnails import (missing_thumbnails, render_thumbnails,
+                              store_thumbnails)
+
+SHARDED = r'^[^/]+/' + r'[0-9a-f]{2}/' * SHARD_DEPTH + r'[0-9a-f]{64}\.'
+
+
+class Command(BaseCommand):
+    help = 'Переносит картинки постов в шардированные каталоги'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch', type=int, default=200,
+            help='Сколько файлов переносить за раз'
+        )
+
+    def handle(self, *args, **options):
+        names = Post.objects.exclude(image='').exclude(
+            image__regex=SHARDED
+        ).order_by('image').values_list('image', flat=True).distinct()
+        moved = failed = 0
+        last = ''
+        while True:
+            batch = list(names.filter(image__gt=last)[:options['batch']])
+            if not batch:
+                break
+            last = batch[-1]
+            renames = self.copy(batch)
+            failed += len(batch) - len(renames)
+            if renames:
+                self.switch(renames)
+                moved += len(renames)
+            self.stdout.write(
+                f'до {last}: перенесено {moved}, ошибок {failed}'
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Файлы перенесены: {moved}, ошибок: {failed}'
+        ))
+
+    def copy(self, batch):
+        """Копирует файлы под новые имена и готовит их миниатюры.
+
+        Старые файлы пока остаются на месте: посты ссылаются на них,
+        пока не переключены.
+        """
+        storage = Post._meta.get_field('image').storage
+        renames = {}
+        for old in batch:
+            try:
+                with storage.open(old) as content:
+                    renames[old] = storage.save(old, content)
+            except (OSError, SuspiciousFileOperation):
+                continue
+        for name in missing_thumbnails(list(renames.values())):
+            try:
+                store_thumbnails(render_thumbnails(name))
+            except Exception:
+                self.stderr.write(f'Не удалось подготовить миниатюры {name}')
+        return renames
+
+    def switch(self, renames):
+        """Переключает посты на новые имена одним UPDATE и чистит старое."""
+        with transaction.atomic():
+            Post.objects.filter(image__in=renames).update(image=Case(
+                *(When(image=old, then=Value(new))
+                  for old, new in renames.items()),
+                output_field=CharField()
+            ), modified=timezone.now())
+            blobs.move(renames)
+        moved = Post.objects.filter(image__in=set(renames.values()))
+        invalidate_authors(*moved.order_by().values_list(
+            'author', flat=True
+        ).distinct())
+        purge_posts(post_rows(moved))
+        for old in renames:
+            blobs.delete_unused(old)
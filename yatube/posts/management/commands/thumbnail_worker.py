@@ -0,0 +1,55 @@
+import time
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+from posts.models import ThumbnailJob
+from posts.thumbnails import (JOB_DONE, JOB_FAILED, JOB_RETRY, claim_jobs,
+                              run_job)
+
+
+class Command(BaseCommand):
+    help = 'Готовит миниатюры картинок постов из очереди заданий'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Разобрать очередь и завершиться'
+        )
+        parser.add_argument(
+            '--batch', type=int, default=20,
+            help='Сколько заданий забирать за раз'
+        )
+        parser.add_argument(
+            '--sleep', type=float, default=2,
+            help='Пауза в секундах, когда очередь пуста'
+        )
+        parser.add_argument(
+            '--retry-failed', action='store_true',
+            help='Вернуть в очередь задания, исчерпавшие попытки'
+        )
+
+    def handle(self, *args, **options):
+        if options['retry_failed']:
+            ThumbnailJob.objects.filter(failed=True).update(
+                failed=False, attempts=0, error=''
+            )
+        results = Counter()
+        while True:
+            jobs = claim_jobs(options['batch'])
+            if not jobs:
+                if options['once']:
+                    break
+                time.sleep(options['sleep'])
+                continue
+            results.update(run_job(job) for job in jobs)
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано заданий: {results[JOB_DONE]}'
+        ))
+        if results[JOB_RETRY]:
+            self.stdout.write(
+                f'Отложено до повтора: {results[JOB_RETRY]}'
+            )
+        if results[JOB_FAILED]:
+            self.stderr.write(self.style.ERROR(
+                f'Не выполнено заданий: {results[JOB_FAILED]}'
+            ))
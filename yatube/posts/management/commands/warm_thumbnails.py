@@ -0,0 +1,82 @@
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import islice
+
+from django.core.management.base import BaseCommand
+from posts.models import Post
+from posts.thumbnails import (missing_thumbnails, render_thumbnails,
+                              store_thumbnails)
+
+logger = logging.getLogger(__name__)
+
+
+def _render(image, overwrite=False):
+    try:
+        return render_thumbnails(image, overwrite)
+    except Exception:
+        logger.exception('Не удалось нарезать миниатюры %s', image)
+        return None
+
+
+def _batches(rows, size):
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+class Command(BaseCommand):
+    help = 'Заранее готовит миниатюры всех картинок постов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count(),
+            help='Число процессов, режущих картинки'
+        )
+        parser.add_argument(
+            '--batch', type=int, default=200,
+            help='Сколько картинок записывать в KV-хранилище за раз'
+        )
+        parser.add_argument(
+            '--after', type=int, default=0,
+            help='Продолжить с постов, id которых больше заданного'
+        )
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Перерезать и уже готовые миниатюры'
+        )
+
+    def handle(self, *args, **options):
+        posts = Post.objects.exclude(image='').filter(
+            pk__gt=options['after']
+        ).order_by('pk').values_list('pk', 'image')
+        started = time.monotonic()
+        done = skipped = failed = 0
+        render = partial(_render, overwrite=options['force'])
+        with ProcessPoolExecutor(options['workers']) as pool:
+            for batch in _batches(posts.iterator(), options['batch']):
+                images = list(dict.fromkeys(image for pk, image in batch))
+                if not options['force']:
+                    images = missing_thumbnails(images)
+                rendered = [
+                    result for result in pool.map(render, images)
+                    if result is not None
+                ]
+                store_thumbnails(
+                    [pair for result in rendered for pair in result]
+                )
+                done += len(rendered)
+                failed += len(images) - len(rendered)
+                skipped += len(batch) - len(images)
+                rate = done / max(time.monotonic() - started, 1e-6)
+                self.stdout.write(
+                    f'id ≤ {batch[-1][0]}: готово {done}, пропущено '
+                    f'{skipped}, ошибок {failed}, {rate:.1f} картинок/с'
+                )
+        self.stdout.write(self.style.SUCCESS(
+            f'Миниатюры готовы: {done}, ошибок: {failed}'
+        ))
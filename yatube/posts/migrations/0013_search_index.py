@@ -0,0 +1,69 @@
+from django.db import migrations
+
+
+def normalized(column):
+    # unicode61 не сводит «ё» к «е», поэтому это делается до индексации.
+    return f"replace(replace({column}, 'ё', 'е'), 'Ё', 'Е')"
+
+
+CREATE = (
+    """
+    CREATE VIRTUAL TABLE posts_post_fts USING fts5(
+        text,
+        content='',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    f"""
+    CREATE TRIGGER posts_post_fts_insert AFTER INSERT ON posts_post BEGIN
+        INSERT INTO posts_post_fts(rowid, text)
+        VALUES (new.id, {normalized('new.text')});
+    END
+    """,
+    f"""
+    CREATE TRIGGER posts_post_fts_delete AFTER DELETE ON posts_post BEGIN
+        INSERT INTO posts_post_fts(posts_post_fts, rowid, text)
+        VALUES ('delete', old.id, {normalized('old.text')});
+    END
+    """,
+    f"""
+    CREATE TRIGGER posts_post_fts_update AFTER UPDATE OF text ON posts_post
+    BEGIN
+        INSERT INTO posts_post_fts(posts_post_fts, rowid, text)
+        VALUES ('delete', old.id, {normalized('old.text')});
+        INSERT INTO posts_post_fts(rowid, text)
+        VALUES (new.id, {normalized('new.text')});
+    END
+    """,
+    f"""
+    INSERT INTO posts_post_fts(rowid, text)
+    SELECT id, {normalized('text')} FROM posts_post
+    """,
+)
+
+DROP = (
+    'DROP TRIGGER IF EXISTS posts_post_fts_insert',
+    'DROP TRIGGER IF EXISTS posts_post_fts_delete',
+    'DROP TRIGGER IF EXISTS posts_post_fts_update',
+    'DROP TABLE IF EXISTS posts_post_fts',
+)
+
+
+def run(statements):
+    def execute(apps, schema_editor):
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return execute
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0012_media_blobs'),
+    ]
+
+    operations = [
+        migrations.RunPython(run(CREATE), run(DROP)),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 2.2.16 on 2026-10-18 02:17
+
+from django.db import migrations, models
+from django.db.models import F
+from importlib import import_module
+
+search_index = import_module('posts.migrations.0013_search_index')
+# SQLite пересоздаёт posts_post при добавлении столбца, и триггеры
+# поискового индекса пропадают вместе со старой таблицей.
+restore_triggers = search_index.run(search_index.CREATE[1:4])
+
+
+def fill_modified(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    Post.objects.update(modified=F('pub_date'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0013_search_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, restore_triggers),
+        migrations.AddField(
+            model_name='post',
+            name='modified',
+            field=models.DateTimeField(auto_now=True, help_text='Последнее изменение поста или его комментариев', verbose_name='Дата изменения'),
+        ),
+        migrations.RunPython(restore_triggers, migrations.RunPython.noop),
+        migrations.RunPython(fill_modified, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['modified'], name='post_modified_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['group', 'modified'], name='post_group_modified_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['author', 'modified'], name='post_author_modified_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.2.16 on 2026-10-18 02:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0014_post_modified'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='thumbnailjob',
+            name='error',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='thumbnailjob',
+            name='failed',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -1,6 +1,7 @@
 from django.db import models
 from django.contrib.auth import get_user_model
 from .constants import TEXT_LEN
+from .storage import ContentAddressedStorage
 
 
 User = get_user_model()
@@ -21,6 +22,11 @@ class Group(models.Model):
         verbose_name='Описание',
         help_text='Описание группы'
     )
+    posts_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Количество постов'
+    )
 
     def __str__(self) -> str:
         return self.title
@@ -37,6 +43,11 @@ class Post(models.Model):
         verbose_name='Дата публикации',
         help_text='День, когда был опубликован пост'
     )
+    modified = models.DateTimeField(
+        auto_now=True,
+        verbose_name='Дата изменения',
+        help_text='Последнее изменение поста или его комментариев'
+    )
     author = models.ForeignKey(
         User,
         null=True,
@@ -57,11 +68,60 @@ class Post(models.Model):
     image = models.ImageField(
         verbose_name='Картинка',
         upload_to='posts/',
-        blank=True
+        storage=ContentAddressedStorage(),
+        blank=True,
+        width_field='image_width',
+        height_field='image_height'
+    )
+    image_width = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        editable=False,
+        verbose_name='Ширина картинки'
+    )
+    image_height = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        editable=False,
+        verbose_name='Высота картинки'
+    )
+    image_placeholder = models.TextField(
+        blank=True,
+        editable=False,
+        verbose_name='Превью картинки',
+        help_text='Крошечная размытая копия картинки в виде data: URI'
+    )
+    comments_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Количество комментариев'
     )
 
     class Meta:
-        ordering = ('-pub_date',)
+        ordering = ('-pub_date', '-id')
+        indexes = (
+            models.Index(
+                fields=('-pub_date', '-id'),
+                name='post_pub_date_idx'
+            ),
+            models.Index(
+                fields=('group', '-pub_date', '-id'),
+                name='post_group_pub_date_idx'
+            ),
+            models.Index(
+                fields=('author', '-pub_date', '-id'),
+                name='post_author_pub_date_idx'
+            ),
+            models.Index(fields=('modified',), name='post_modified_idx'),
+            models.Index(
+                fields=('group', 'modified'),
+                name='post_group_modified_idx'
+            ),
+            models.Index(
+                fields=('author', 'modified'),
+                name='post_author_modified_idx'
+            ),
+        )
 
     def __str__(self) -> str:
         return self.text[:TEXT_LEN]
@@ -94,7 +154,13 @@ class Comment(models.Model):
     )
 
     class Meta:
-        ordering = ('-created',)
+        ordering = ('-created', '-id')
+        indexes = (
+            models.Index(
+                fields=('post', '-created', '-id'),
+                name='comment_post_created_idx'
+            ),
+        )
 
     def __str__(self) -> str:
         return self.text[:TEXT_LEN]
@@ -111,3 +177,101 @@ class Follow(models.Model):
         on_delete=models.CASCADE,
         related_name='following'
     )
+
+    class Meta:
+        constraints = (
+            models.UniqueConstraint(
+                fields=('user', 'author'),
+                name='unique_follow'
+            ),
+            models.CheckConstraint(
+                check=~models.Q(user=models.F('author')),
+                name='prevent_self_follow'
+            ),
+        )
+
+
+class Timeline(models.Model):
+    """Материализованная лента подписок: пост, разосланный читателю."""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='timeline'
+    )
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='timeline'
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+    pub_date = models.DateTimeField()
+
+    class Meta:
+        constraints = (
+            models.UniqueConstraint(
+                fields=('user', 'post'),
+                name='unique_timeline_post'
+            ),
+        )
+        indexes = (
+            models.Index(
+                fields=('user', '-pub_date', '-post'),
+                name='timeline_user_pub_date_idx'
+            ),
+            models.Index(
+                fields=('user', 'author'),
+                name='timeline_user_author_idx'
+            ),
+        )
+
+
+class PulledAuthor(models.Model):
+    """Автор, чьи посты не рассылаются, а подтягиваются при чтении."""
+    author = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        related_name='pulled'
+    )
+
+
+class UserCounters(models.Model):
+    """Счётчики пользователя, которые обновляются при записи."""
+    user = models.OneToOneField(
+        User,
+        primary_key=True,
+        on_delete=models.CASCADE,
+        related_name='counters'
+    )
+    posts_count = models.PositiveIntegerField(default=0)
+    followers_count = models.PositiveIntegerField(default=0)
+    following_count = models.PositiveIntegerField(default=0)
+
+
+class MediaBlob(models.Model):
+    """Файл картинки в хранилище и число постов, которые на него ссылаются.
+    """
+    name = models.CharField(max_length=255, unique=True)
+    refs = models.PositiveIntegerField(default=0)
+
+
+class ThumbnailJob(models.Model):
+    """Задание очереди на подготовку миниатюры картинки поста."""
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='thumbnail_jobs'
+    )
+    created = models.DateTimeField(auto_now_add=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    locked_by = models.CharField(max_length=32, blank=True)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    # Задание, исчерпавшее попытки, остаётся в базе для разбора.
+    failed = models.BooleanField(default=False)
+    error = models.TextField(blank=True)
+
+    class Meta:
+        ordering = ('id',)
@@ -0,0 +1,131 @@
+import hashlib
+import time
+from functools import wraps
+
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import parse_http_date_safe
+from core.cache import near_cache
+from .constants import PAGE_CACHE_TIMEOUT
+from .models import Post, User
+
+PAGES = 'pages'
+SURROGATE_HEADER = 'Surrogate-Key'
+INDEX_KEY = 'feed:index'
+
+
+def _hash(value):
+    return hashlib.md5(value.encode()).hexdigest()
+
+
+def _purge_key(tag):
+    return f'surrogate:{_hash(tag)}'
+
+
+def purge(*tags):
+    """Сбрасывает страницы с любым из суррогатных ключей tags.
+
+    Для ключа запоминается время сброса: закэшированная раньше него
+    страница считается устаревшей.
+    """
+    now = time.time()
+    cache.set_many({_purge_key(tag): now for tag in tags}, None)
+
+
+def _fresh(created, tags):
+    keys = [_purge_key(tag) for tag in tags]
+    purged = cache.get_many(keys)
+    missing = [key for key in keys if key not in purged]
+    if missing:
+        # Время сброса вытеснено из кэша: страница могла устареть.
+        cache.set_many({key: time.time() for key in missing}, None)
+        return False
+    return all(stamp <= created for stamp in purged.values())
+
+
+def _store(key, created, tags, response):
+    for tag in tags:
+        # Ключ без отметки о сбросе отсчитывается от этой страницы.
+        cache.add(_purge_key(tag), created, None)
+    # Ответ хранится частями: из LRU процесса его берут разные запросы,
+    # и каждому нужен свой объект, который могут менять middleware.
+    near_cache.set(PAGES, key, (
+        created, tags, response.status_code, response.content,
+        list(response.items())
+    ), PAGE_CACHE_TIMEOUT)
+
+
+def tagged(response, *tags):
+    """Помечает ответ суррогатными ключами для кэша страниц."""
+    response[SURROGATE_HEADER] = ' '.join(tag for tag in tags if tag)
+    return response
+
+
+def post_tags(post_id, username, slug):
+    """Ключи страницы поста; он же виден в ленте автора и группы."""
+    return (f'post:{post_id}',
+            username and f'author:{username}', slug and f'group:{slug}')
+
+
+def purge_posts(posts):
+    """Сбрасывает главную и страницы постов по строкам (id, автор, группа).
+    """
+    purge(INDEX_KEY, *{tag for row in posts for tag in post_tags(*row)
+                       if tag})
+
+
+def post_rows(posts):
+    return posts.values_list('pk', 'author__username', 'group__slug')
+
+
+def purge_post_ids(*post_ids):
+    purge_posts(post_rows(Post.objects.filter(pk__in=post_ids)))
+
+
+def purge_authors(*user_ids):
+    purge(*(f'author:{username}' for username in User.objects.filter(
+        pk__in=user_ids
+    ).values_list('username', flat=True)))
+
+
+def _cacheable(request, response):
+    return (response.status_code == 200
+            and SURROGATE_HEADER in response
+            and not response.cookies
+            and not request.META.get('CSRF_COOKIE_USED'))
+
+
+def _from_cache(request, status, content, headers):
+    response = HttpResponse(content, status=status)
+    for header, value in headers:
+        response[header] = value
+    last_modified = response.get('Last-Modified')
+    return get_conditional_response(
+        request,
+        etag=response.get('ETag'),
+        last_modified=last_modified and parse_http_date_safe(last_modified),
+        response=response
+    )
+
+
+def cache_anonymous_page(view):
+    """Кэширует страницу целиком для гостей до сброса её ключей."""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if (request.method not in ('GET', 'HEAD')
+                or request.user.is_authenticated):
+            return view(request, *args, **kwargs)
+        key = f'page:{_hash(request.get_full_path())}'
+        entry = near_cache.get(PAGES, key)
+        if entry is not None:
+            created, tags, *response = entry
+            if _fresh(created, tags):
+                return _from_cache(request, *response)
+        created = time.time()
+        response = view(request, *args, **kwargs)
+        if _cacheable(request, response):
+            _store(key, created, response[SURROGATE_HEADER].split(),
+                   response)
+        return response
+    return wrapper
@@ -0,0 +1,67 @@
+import hashlib
+from collections import namedtuple
+
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Exists, OuterRef
+from django.shortcuts import get_object_or_404
+from .constants import PROFILE_CACHE_TIMEOUT
+from .counters import user_counters
+from .follows import following_ids
+from .models import Follow, User, UserCounters
+
+ProfileSummary = namedtuple('ProfileSummary', 'author counters following')
+# В кэш кладутся только поля шапки: ни хэша пароля, ни почты.
+AUTHOR_FIELDS = ('id', 'username', 'first_name', 'last_name')
+COUNTER_FIELDS = ('posts_count', 'followers_count', 'following_count')
+
+
+def _key(username):
+    digest = hashlib.md5(username.encode()).hexdigest()
+    return f'profile_summary:{digest}'
+
+
+def _is_following(viewer, author):
+    return author.pk in following_ids(viewer)
+
+
+def profile_summary(username, viewer):
+    """Шапка профиля: автор, его счётчики и подписан ли на него читатель.
+
+    Автор со счётчиками берётся из кэша, подписка — из закэшированного
+    множества подписок читателя; при промахе всё читается одним запросом.
+    """
+    cached = cache.get(_key(username))
+    if cached is not None:
+        author_values, counter_values = cached
+        author = User.from_db(DEFAULT_DB_ALIAS, AUTHOR_FIELDS, author_values)
+        counters = UserCounters(user_id=author.pk,
+                                **dict(zip(COUNTER_FIELDS, counter_values)))
+        return ProfileSummary(author, counters,
+                              _is_following(viewer, author))
+    authors = User.objects.select_related('counters')
+    if viewer.is_authenticated:
+        authors = authors.annotate(is_followed=Exists(
+            Follow.objects.filter(user=viewer, author=OuterRef('pk'))
+        ))
+    author = get_object_or_404(authors, username=username)
+    following = vars(author).pop('is_followed', False)
+    counters = user_counters(author)
+    cache.set(_key(username), (
+        tuple(getattr(author, field) for field in AUTHOR_FIELDS),
+        tuple(getattr(counters, field) for field in COUNTER_FIELDS)
+    ), PROFILE_CACHE_TIMEOUT)
+    return ProfileSummary(author, counters, following)
+
+
+def invalidate_profile(*user_ids):
+    """Сбрасывает закэшированные шапки профилей пользователей."""
+    forget_profiles(*User.objects.filter(pk__in=user_ids).values_list(
+        'username', flat=True
+    ))
+
+
+def forget_profiles(*usernames):
+    """Сбрасывает шапки профилей по именам, например после переименования.
+    """
+    cache.delete_many([_key(username) for username in usernames])
@@ -0,0 +1,162 @@
+import re
+
+from django.db import DEFAULT_DB_ALIAS, connection, connections, transaction
+from django.utils.encoding import force_bytes, force_text
+from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
+from .constants import PER_PAGE, SEARCH_MAX_TERMS
+from .models import Post
+
+MATCH = 'SELECT rowid FROM posts_post_fts WHERE posts_post_fts MATCH %s'
+
+
+def normalized(column):
+    # Индекс хранит текст с «ё», сведённой к «е» (см. миграцию 0013).
+    return f"replace(replace({column}, 'ё', 'е'), 'Ё', 'Е')"
+
+
+# Те же триггеры, что в миграции 0013. SQLite удаляет их, когда Django
+# пересоздаёт posts_post, поэтому после migrate они ставятся заново.
+TRIGGERS = {
+    'posts_post_fts_insert': f"""
+        CREATE TRIGGER IF NOT EXISTS posts_post_fts_insert
+        AFTER INSERT ON posts_post BEGIN
+            INSERT INTO posts_post_fts(rowid, text)
+            VALUES (new.id, {normalized('new.text')});
+        END
+    """,
+    'posts_post_fts_delete': f"""
+        CREATE TRIGGER IF NOT EXISTS posts_post_fts_delete
+        AFTER DELETE ON posts_post BEGIN
+            INSERT INTO posts_post_fts(posts_post_fts, rowid, text)
+            VALUES ('delete', old.id, {normalized('old.text')});
+        END
+    """,
+    'posts_post_fts_update': f"""
+        CREATE TRIGGER IF NOT EXISTS posts_post_fts_update
+        AFTER UPDATE OF text ON posts_post BEGIN
+            INSERT INTO posts_post_fts(posts_post_fts, rowid, text)
+            VALUES ('delete', old.id, {normalized('old.text')});
+            INSERT INTO posts_post_fts(rowid, text)
+            VALUES (new.id, {normalized('new.text')});
+        END
+    """,
+}
+
+
+def enabled():
+    """Индекс FTS5 есть только в SQLite."""
+    return connection.vendor == 'sqlite'
+
+
+def fts_query(text):
+    """Переводит ввод пользователя в безопасный запрос FTS5.
+
+    Каждое слово берётся в кавычки, поэтому операторы FTS5 во вводе
+    не работают; последнее слово ищется как префикс.
+    """
+    text = text.lower().replace('ё', 'е')
+    terms = re.findall(r'\w+', text)[:SEARCH_MAX_TERMS]
+    if not terms:
+        return None
+    return ' '.join(f'"{term}"' for term in terms) + '*'
+
+
+def matching(queryset, text):
+    """Сужает queryset до постов, найденных по индексу."""
+    query = fts_query(text)
+    if query is None:
+        return queryset.none()
+    if not enabled():
+        return queryset.filter(text__icontains=text)
+    # RawSQL в pk__in стал бы скалярным подзапросом «IN ((SELECT …))»,
+    # и совпал бы только первый rowid.
+    return queryset.extra(
+        where=[f'{Post._meta.db_table}.id IN ({MATCH})'], params=[query]
+    )
+
+
+def _encode(rank, pk):
+    return urlsafe_base64_encode(force_bytes(f'{rank!r}|{pk}'))
+
+
+def _decode(cursor):
+    try:
+        rank, pk = force_text(urlsafe_base64_decode(cursor)).split('|')
+        return float(rank), int(pk)
+    except (ValueError, TypeError, UnicodeDecodeError):
+        return None
+
+
+def search_page(text, cursor=None, per_page=PER_PAGE):
+    """Страница результатов по релевантности и курсор следующей.
+
+    Ранжирование и отбор страницы делает FTS5 (bm25, затем rowid),
+    поэтому из posts_post читаются только посты самой страницы.
+    """
+    query = fts_query(text)
+    if query is None or not enabled():
+        return [], None
+    sql = (
+        'SELECT rowid, rank FROM posts_post_fts '
+        'WHERE posts_post_fts MATCH %s'
+    )
+    params = [query]
+    key = _decode(cursor) if cursor else None
+    if key is not None:
+        sql += ' AND (rank > %s OR (rank = %s AND rowid > %s))'
+        params += [key[0], key[0], key[1]]
+    sql += ' ORDER BY rank, rowid LIMIT %s'
+    params.append(per_page + 1)
+    with connection.cursor() as db:
+        db.execute(sql, params)
+        rows = db.fetchall()
+    page = rows[:per_page]
+    posts = Post.objects.select_related('author', 'group').in_bulk(
+        [pk for pk, _ in page]
+    )
+    next_cursor = None
+    if len(rows) > per_page:
+        next_cursor = _encode(page[-1][1], page[-1][0])
+    return [posts[pk] for pk, _ in page if pk in posts], next_cursor
+
+
+def rebuild(using=DEFAULT_DB_ALIAS):
+    """Перестраивает индекс по текущему содержимому posts_post."""
+    if connections[using].vendor != 'sqlite':
+        return
+    with transaction.atomic(using), connections[using].cursor() as db:
+        db.execute(
+            "INSERT INTO posts_post_fts(posts_post_fts) VALUES ('delete-all')"
+        )
+        db.execute(
+            'INSERT INTO posts_post_fts(rowid, text) '
+            f"SELECT id, {normalized('text')} FROM posts_post"
+        )
+        db.execute(
+            "INSERT INTO posts_post_fts(posts_post_fts) VALUES ('optimize')"
+        )
+
+
+def ensure_triggers(using=DEFAULT_DB_ALIAS):
+    """Ставит пропавшие триггеры индекса и перестраивает его.
+
+    Пока триггеров не было, индекс мог разойтись с posts_post,
+    поэтому после их восстановления он собирается заново.
+    """
+    if connections[using].vendor != 'sqlite':
+        return
+    with connections[using].cursor() as db:
+        db.execute(
+            "SELECT name FROM sqlite_master "
+            "WHERE name = 'posts_post_fts' OR name IN (%s, %s, %s)",
+            list(TRIGGERS)
+        )
+        existing = {name for name, in db.fetchall()}
+        if 'posts_post_fts' not in existing:
+            return
+        missing = [name for name in TRIGGERS if name not in existing]
+        if not missing:
+            return
+        for name in missing:
+            db.execute(TRIGGERS[name])
+    rebuild(using)
@@ -0,0 +1,188 @@
+from django.db.models.signals import (post_delete, post_init, post_save,
+                                      pre_save)
+from django.core.cache import cache
+from django.dispatch import receiver
+from core.cache import near_cache
+from . import blobs, caching, counters, pagecache, search, timeline
+from .follows import forget_following
+from .profiles import forget_profiles, invalidate_profile
+from .models import Comment, Follow, Group, Post, User
+
+# Размеры картинки считаются при загрузке файла, а не при каждом
+# создании объекта Post из строки базы; старые записи заполняет
+# команда backfill_image_meta.
+post_init.disconnect(
+    Post._meta.get_field('image').update_dimension_fields, sender=Post
+)
+
+
+@receiver(pre_save, sender=Post)
+def post_image_changing(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    if instance.image and not instance.image._committed:
+        sender._meta.get_field('image').update_dimension_fields(
+            instance, force=True
+        )
+    instance._previous_image = instance._previous_group = None
+    instance._previous_group_id = instance.group_id
+    if not instance._state.adding:
+        previous = sender.objects.filter(pk=instance.pk).values_list(
+            'image', 'group__slug', 'group'
+        ).first()
+        if previous is not None:
+            (instance._previous_image, instance._previous_group,
+             instance._previous_group_id) = previous
+
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        counters.change_user(instance.author_id, 'posts_count', 1)
+        counters.change_group(instance.group_id, 1)
+        timeline.fan_out(instance)
+        invalidate_profile(instance.author_id)
+    else:
+        timeline.refresh(instance)
+        counters.move_post(
+            getattr(instance, '_previous_group_id', instance.group_id),
+            instance.group_id
+        )
+    previous = getattr(instance, '_previous_image', None)
+    if previous != instance.image.name:
+        blobs.acquire(instance.image.name)
+        blobs.release(previous)
+    caching.invalidate_post(instance)
+    pagecache.purge_post_ids(instance.pk)
+    previous_group = getattr(instance, '_previous_group', None)
+    if previous_group:
+        pagecache.purge(f'group:{previous_group}')
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    counters.change_user(instance.author_id, 'posts_count', -1)
+    counters.change_group(instance.group_id, -1)
+    invalidate_profile(instance.author_id)
+    blobs.release(instance.image.name)
+    caching.invalidate_post(instance)
+    pagecache.purge_posts([(
+        instance.pk,
+        instance.author and instance.author.username,
+        instance.group and instance.group.slug
+    )])
+
+
+@receiver(post_save, sender=Comment)
+def comment_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        counters.change_post(instance.post_id, 1)
+        # Число комментариев видно на карточках главной; в закэшированной
+        # ленте подписок его нет, чтобы не сбрасывать ленты всех
+        # подписчиков автора на каждый комментарий.
+        caching.invalidate_index()
+        pagecache.purge_post_ids(instance.post_id)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    counters.change_post(instance.post_id, -1)
+    caching.invalidate_index()
+    pagecache.purge_post_ids(instance.post_id)
+
+
+@receiver(post_save, sender=Follow)
+def follow_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        counters.change_user(instance.author_id, 'followers_count', 1)
+        counters.change_user(instance.user_id, 'following_count', 1)
+        forget_following(instance.user_id)
+        timeline.backfill(instance.user_id, instance.author_id)
+        invalidate_profile(instance.user_id, instance.author_id)
+        caching.invalidate_follow(instance.user_id)
+        pagecache.purge_authors(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    counters.change_user(instance.author_id, 'followers_count', -1)
+    counters.change_user(instance.user_id, 'following_count', -1)
+    forget_following(instance.user_id)
+    timeline.trim(instance.user_id, instance.author_id)
+    timeline.demote(instance.author_id)
+    invalidate_profile(instance.user_id, instance.author_id)
+    caching.invalidate_follow(instance.user_id)
+    pagecache.purge_authors(instance.user_id, instance.author_id)
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def group_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        caching.invalidate_groups()
+        pagecache.purge(f'group:{instance.slug}')
+
+
+def _only_login(update_fields):
+    # Вход обновляет только last_login, на страницах это не видно.
+    return update_fields == frozenset(('last_login',))
+
+
+@receiver(pre_save, sender=User)
+def user_saving(sender, instance, raw=False, update_fields=None, **kwargs):
+    instance._previous_username = None
+    if raw or instance._state.adding or _only_login(update_fields):
+        return
+    instance._previous_username = sender.objects.filter(
+        pk=instance.pk
+    ).values_list('username', flat=True).first()
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, raw=False, update_fields=None,
+               **kwargs):
+    if raw or created or _only_login(update_fields):
+        return
+    usernames = {instance.username,
+                 getattr(instance, '_previous_username', None)} - {None}
+    forget_profiles(*usernames)
+    # Имя автора есть на карточках главной, лент и страниц его групп.
+    caching.invalidate_authors(instance.pk)
+    slugs = Post.objects.filter(
+        author=instance, group__isnull=False
+    ).order_by().values_list('group__slug', flat=True).distinct()
+    pagecache.purge(
+        pagecache.INDEX_KEY,
+        *(f'author:{username}' for username in usernames),
+        *(f'group:{slug}' for slug in slugs)
+    )
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    forget_profiles(instance.username)
+    pagecache.purge(f'author:{instance.username}')
+
+
+def clear_cache(sender, **kwargs):
+    """Сбрасывает общий кэш после миграций.
+
+    В нём лежат объекты моделей и страницы, собранные по старой схеме.
+    """
+    cache.clear()
+    near_cache.reset_versions()
+
+
+def restore_search_triggers(sender, using, **kwargs):
+    """Возвращает триггеры поискового индекса, снесённые миграцией.
+
+    SQLite пересоздаёт posts_post при многих изменениях схемы, и
+    триггеры пропадают вместе со старой таблицей.
+    """
+    search.ensure_triggers(using)
@@ -0,0 +1,59 @@
+import hashlib
+import os
+from uuid import uuid4
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+SHARD_DEPTH = 2
+
+
+def sharded_name(directory, digest, extension):
+    """Раскладывает файл по подкаталогам из первых символов хэша.
+
+    posts/ + 3f2a… -> posts/3f/2a/3f2a….jpg: в каждом каталоге остаётся
+    не больше 256 подкаталогов, а не миллионы файлов.
+    """
+    shards = [digest[2 * level:2 * level + 2] for level in range(SHARD_DEPTH)]
+    return os.path.join(directory, *shards, digest + extension)
+
+
+def content_hash(content):
+    """SHA-256 содержимого файла, прочитанного кусками."""
+    digest = hashlib.sha256()
+    for chunk in content.chunks():
+        digest.update(chunk)
+    content.seek(0)
+    return digest.hexdigest()
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """Хранилище, где имя файла — хэш его содержимого.
+
+    Одинаковые файлы сохраняются один раз и получают одно имя, поэтому
+    и миниатюры sorl у них общие. Файлы раскладываются по подкаталогам
+    (см. sharded_name). Файл пишется под временным именем и атомарно
+    переименовывается, так что параллельные загрузки одного содержимого
+    не мешают друг другу.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        return name
+
+    def _save(self, name, content):
+        directory, filename = os.path.split(name)
+        extension = os.path.splitext(filename)[1].lower()
+        name = sharded_name(directory, content_hash(content), extension)
+        if self.exists(name):
+            # Сборщик не трогает свежие файлы: новая ссылка на старый
+            # файл должна продлить ему жизнь до сохранения поста.
+            os.utime(self.path(name))
+            return name
+        temporary = super()._save(
+            os.path.join(os.path.dirname(name), f'.{uuid4().hex}{extension}'),
+            content
+        )
+        os.replace(self.path(temporary), self.path(name))
+        return name
@@ -1,8 +1,10 @@
 import shutil
 import tempfile
+from hashlib import sha256
 
 from django.test import Client, TestCase, override_settings
 from ..models import Group, Post, Comment
+from ..storage import sharded_name
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 from django.core.files.uploadedfile import SimpleUploadedFile
@@ -96,7 +98,9 @@ class CreateFormTest(TestCase):
         self.assertTrue(
             Post.objects.filter(
                 text='Тестовый пост с картинкой',
-                image='posts/small.gif'
+                image=sharded_name(
+                    'posts', sha256(small_gif).hexdigest(), '.gif'
+                )
             ).exists()
         )
 
@@ -123,6 +127,6 @@ class CreateFormTest(TestCase):
         response = self.authorized_client.get(reverse('posts:post_detail',
                                               kwargs={'post_id': self.post.id})
                                               )
-        comment_text = response.context['comments'].last().text
+        comment_text = response.context['comments'][-1].text
         self.assertEqual(comment_text, form_data['text'])
         self.assertEqual(Comment.objects.all().count(), 1)
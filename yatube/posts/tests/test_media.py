@@ -0,0 +1,204 @@
+import os
+import shutil
+import tempfile
+from hashlib import sha256
+from io import BytesIO, StringIO
+from unittest import mock
+
+from django.test import TestCase, TransactionTestCase, override_settings
+from ..management.commands.collect_media import Command
+from ..models import Post, MediaBlob, ThumbnailJob
+from ..storage import sharded_name
+from ..thumbnails import VARIANTS, cached_variants
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.conf import settings
+from PIL import Image
+from django.core.management import call_command
+
+User = get_user_model()
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+SMALL_GIF = (b'\x47\x49\x46\x38\x39\x61\x02\x00'
+             b'\x01\x00\x80\x00\x00\x00\x00\x00'
+             b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+             b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+             b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+             b'\x0A\x00\x3B'
+             )
+
+
+def gif(name, shade=0):
+    """Маленькая GIF-картинка; разный shade даёт разное содержимое."""
+    buffer = BytesIO()
+    Image.new('L', (2, 1), shade).save(buffer, 'GIF')
+    return SimpleUploadedFile(name, buffer.getvalue(), 'image/gif')
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class MediaBlobTest(TransactionTestCase):
+    """Удаление файлов идёт после коммита, поэтому тут нужны транзакции"""
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='Collector')
+        self.client.force_login(self.user)
+
+    def create_post(self, name):
+        self.client.post(reverse('posts:post_create'), data={
+            'text': 'Одинаковая картинка', 'image': gif(name, 80)
+        })
+        return Post.objects.filter(author=self.user).latest('id')
+
+    def test_identical_images_stored_once(self):
+        """Одинаковые картинки хранятся одним файлом со счётчиком ссылок"""
+        first = self.create_post('first.gif')
+        call_command('thumbnail_worker', '--once', stdout=StringIO())
+        second = self.create_post('second.gif')
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertFalse(ThumbnailJob.objects.exists())
+        self.assertEqual(MediaBlob.objects.get(name=first.image.name).refs, 2)
+        path = first.image.path
+        thumbnail = cached_variants(first.image)[0][1]
+        first.delete()
+        self.assertTrue(os.path.exists(path))
+        second.delete()
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(thumbnail.exists())
+        self.assertFalse(MediaBlob.objects.exists())
+
+    def test_shard_media(self):
+        """Команда переносит старые файлы в шарды и переключает посты"""
+        legacy = os.path.join(TEMP_MEDIA_ROOT, 'posts', 'legacy.gif')
+        os.makedirs(os.path.dirname(legacy), exist_ok=True)
+        with open(legacy, 'wb') as file_:
+            file_.write(SMALL_GIF)
+        for _ in range(2):
+            Post.objects.create(text='Старый пост', author=self.user,
+                                image='posts/legacy.gif')
+        call_command('shard_media', stdout=StringIO())
+        name = sharded_name('posts', sha256(SMALL_GIF).hexdigest(), '.gif')
+        self.assertEqual(
+            set(Post.objects.values_list('image', flat=True)), {name}
+        )
+        self.assertEqual(MediaBlob.objects.get().refs, 2)
+        self.assertFalse(os.path.exists(legacy))
+        post = Post.objects.first()
+        self.assertTrue(os.path.exists(post.image.path))
+        self.assertEqual(len(cached_variants(post.image)), len(VARIANTS))
+        out = StringIO()
+        call_command('shard_media', stdout=out)
+        self.assertIn('Файлы перенесены: 0', out.getvalue())
+
+    def test_collect_media(self):
+        """Сборщик удаляет только файлы, на которые никто не ссылается"""
+        post = self.create_post('kept.gif')
+        call_command('thumbnail_worker', '--once', stdout=StringIO())
+        thumbnails = [thumbnail for _, thumbnail in
+                      cached_variants(post.image)]
+        orphans = [os.path.join(TEMP_MEDIA_ROOT, 'posts', 'orphan.gif'),
+                   os.path.join(TEMP_MEDIA_ROOT, 'cache', 'ab', 'old.jpg')]
+        for path in orphans:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as file_:
+                file_.write(SMALL_GIF)
+        out = StringIO()
+        call_command('collect_media', '--dry-run', '--min-age=0', stdout=out)
+        self.assertIn('Будет удалено файлов: 2', out.getvalue())
+        self.assertTrue(all(os.path.exists(path) for path in orphans))
+        call_command('collect_media', '--min-age=0', stdout=StringIO())
+        self.assertFalse(any(os.path.exists(path) for path in orphans))
+        self.assertTrue(os.path.exists(post.image.path))
+        self.assertTrue(all(thumbnail.exists() for thumbnail in thumbnails))
+
+    def test_collect_media_keeps_reused_file(self):
+        """Повторная загрузка продлевает жизнь файлу, ссылки перепроверяются"""
+        post = self.create_post('reused.gif')
+        path = post.image.path
+        with open(path, 'rb') as file_:
+            content = file_.read()
+        os.utime(path, (0, 0))
+        post.image.storage.save('posts/copy.gif', ContentFile(content))
+        self.assertGreater(os.path.getmtime(path), 0)
+        os.utime(path, (0, 0))
+        with mock.patch.object(Command, 'orphan_originals',
+                               side_effect=lambda names: names):
+            call_command('collect_media', '--min-age=0', stdout=StringIO())
+        self.assertTrue(os.path.exists(path))
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class UploadPipelineTest(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='Photographer')
+        self.client.force_login(self.user)
+
+    @staticmethod
+    def image_file(name, image, format_, **options):
+        buffer = BytesIO()
+        image.save(buffer, format_, **options)
+        return SimpleUploadedFile(name, buffer.getvalue())
+
+    def upload(self, image):
+        return self.client.post(reverse('posts:post_create'), data={
+            'text': 'Загрузка', 'image': image
+        })
+
+    def test_exif_orientation_normalized(self):
+        """Картинка поворачивается по EXIF и сохраняется без метаданных"""
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        self.upload(self.image_file(
+            'phone.jpg', Image.new('RGB', (4, 2)), 'JPEG', exif=exif
+        ))
+        post = Post.objects.get(author=self.user)
+        self.assertEqual((post.image_width, post.image_height), (2, 4))
+        with Image.open(post.image.path) as image:
+            self.assertEqual(image.size, (2, 4))
+            self.assertEqual(dict(image.getexif()), {})
+
+    def test_decompression_bomb_rejected(self):
+        """Картинка с огромным числом пикселей отклоняется"""
+        response = self.upload(self.image_file(
+            'bomb.png', Image.new('1', (8000, 8000)), 'PNG'
+        ))
+        self.assertFalse(Post.objects.exists())
+        self.assertFormError(
+            response, 'form', 'image',
+            'Слишком большое разрешение картинки: 64000000 пикселей.'
+        )
+
+    def test_full_decode_limit(self):
+        """PNG без уменьшенного декодирования ограничен строже JPEG"""
+        response = self.upload(self.image_file(
+            'large.png', Image.new('1', (4000, 4000)), 'PNG'
+        ))
+        self.assertFalse(Post.objects.exists())
+        self.assertFormError(
+            response, 'form', 'image',
+            'Слишком большое разрешение картинки: 16000000 пикселей.'
+        )
+        self.upload(self.image_file(
+            'large.jpg', Image.new('L', (4000, 4000)), 'JPEG'
+        ))
+        self.assertTrue(Post.objects.exists())
+
+    @override_settings(IMAGE_UPLOAD_MAX_SIZE=16)
+    def test_oversized_upload_rejected(self):
+        """Файл больше допустимого размера не сохраняется"""
+        response = self.upload(SimpleUploadedFile('big.gif', SMALL_GIF))
+        self.assertFalse(Post.objects.exists())
+        self.assertFormError(
+            response, 'form', 'image',
+            'Файл пустой или больше допустимого размера.'
+        )
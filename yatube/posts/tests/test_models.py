@@ -1,6 +1,12 @@
+import re
+import unittest
+
 from django.contrib.auth import get_user_model
-from django.test import TestCase
-from ..models import Group, Post
+from django.db import IntegrityError, connection
+from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from ..models import Comment, Follow, Group, Post
 
 User = get_user_model()
 
@@ -91,3 +97,70 @@ class PostModelTest(TestCase):
                 self.assertEqual(
                     post._meta.get_field(field).help_text, value
                 )
+
+
+class FollowConstraintTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='reader')
+        self.author = User.objects.create_user(username='writer')
+
+    def test_follow_is_unique(self):
+        """Повторная подписка на того же автора запрещена в БД"""
+        Follow.objects.create(user=self.user, author=self.author)
+        with self.assertRaises(IntegrityError):
+            Follow.objects.create(user=self.user, author=self.author)
+
+    def test_self_follow_is_forbidden(self):
+        """Подписка на самого себя запрещена в БД"""
+        with self.assertRaises(IntegrityError):
+            Follow.objects.create(user=self.user, author=self.user)
+
+
+FULL_SCAN = re.compile(r'\bSCAN (TABLE )?posts_\w+\b(?! USING)')
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', 'EXPLAIN для SQLite')
+class FeedQueryPlanTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='reader')
+        cls.author = User.objects.create_user(username='writer')
+        cls.group = Group.objects.create(
+            title='Группа', slug='plan-group', description='Описание'
+        )
+        Post.objects.bulk_create(
+            Post(text='Пост ' + str(i), author=cls.author, group=cls.group)
+            for i in range(25)
+        )
+        Follow.objects.create(user=cls.user, author=cls.author)
+        cls.post = Post.objects.first()
+        Comment.objects.create(post=cls.post, author=cls.user, text='Текст')
+
+    def setUp(self):
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+
+    def feed_queries(self, url):
+        """Собирает SQL, который выполняют страницы ленты"""
+        with CaptureQueriesContext(connection) as context:
+            page_obj = self.authorized_client.get(url).context['page_obj']
+            self.authorized_client.get(url + page_obj.paginator.next_link)
+        return [query['sql'] for query in context.captured_queries
+                if query['sql'].startswith('SELECT')]
+
+    def test_feeds_do_not_scan_tables(self):
+        """Ленты читаются поиском по индексу, без полного обхода таблиц"""
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': self.group.slug}),
+            reverse('posts:profile', kwargs={'username': 'writer'}),
+            reverse('posts:follow_index'),
+        )
+        for url in urls:
+            for sql in self.feed_queries(url):
+                with connection.cursor() as cursor:
+                    cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+                    plan = '\n'.join(str(row[-1]) for row in cursor)
+                with self.subTest(url=url, sql=sql):
+                    self.assertIsNone(FULL_SCAN.search(plan), plan)
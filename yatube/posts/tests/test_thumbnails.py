@@ -0,0 +1,212 @@
+import shutil
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.test import TestCase, override_settings
+from ..management.commands import warm_thumbnails
+from ..models import Post, ThumbnailJob
+from ..constants import THUMBNAIL_WIDTHS
+from ..thumbnails import (VARIANTS, attach_pictures, cached_variants,
+                          claim_jobs, variant_files)
+from .test_media import gif
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+from django.utils import timezone
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+
+User = get_user_model()
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ThumbnailQueueTest(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='Painter')
+        self.client.force_login(self.user)
+
+    def create_post(self, name, shade=0):
+        self.client.post(reverse('posts:post_create'), data={
+            'text': 'Пост с картинкой',
+            'image': gif(name, shade),
+        })
+        return Post.objects.filter(author=self.user).latest('id')
+
+    def test_upload_enqueues_job(self):
+        """Загрузка картинки ставит миниатюру в очередь, а не режет её"""
+        post = self.create_post('queued.gif', 10)
+        self.assertTrue(ThumbnailJob.objects.filter(post=post).exists())
+        self.assertEqual(cached_variants(post.image), [])
+        response = self.client.get(
+            reverse('posts:post_detail', kwargs={'post_id': post.id})
+        )
+        self.assertContains(response, f'src="{post.image_placeholder}"')
+
+    def test_edit_without_image_change_skips_queue(self):
+        """Правка текста не ставит миниатюру в очередь повторно"""
+        post = self.create_post('kept.gif', 20)
+        ThumbnailJob.objects.all().delete()
+        self.client.post(
+            reverse('posts:post_edit', kwargs={'post_id': post.id}),
+            data={'text': 'Новый текст'}
+        )
+        self.assertFalse(ThumbnailJob.objects.exists())
+
+    def test_worker_drains_queue(self):
+        """Обработчик очереди готовит все варианты и удаляет задание"""
+        post = self.create_post('worker.gif', 30)
+        call_command('thumbnail_worker', '--once', stdout=StringIO())
+        self.assertFalse(ThumbnailJob.objects.exists())
+        variants = cached_variants(post.image)
+        self.assertEqual(len(variants), len(VARIANTS))
+        response = self.client.get(
+            reverse('posts:post_detail', kwargs={'post_id': post.id})
+        )
+        self.assertContains(response, '<picture>')
+        for variant, thumbnail in variants:
+            self.assertEqual(thumbnail.width, variant.width)
+            self.assertContains(
+                response, f'{thumbnail.url} {variant.width}w'
+            )
+
+    def test_failed_job_backs_off(self):
+        """Упавшее задание не забирается сразу, пауза растёт с попытками"""
+        self.create_post('flaky.gif', 45)
+        delays = []
+        with mock.patch('posts.thumbnails.make_thumbnails',
+                        side_effect=OSError('диск занят')), \
+                self.assertLogs('posts.thumbnails', 'ERROR'):
+            for _ in range(2):
+                out = StringIO()
+                call_command('thumbnail_worker', '--once', stdout=out)
+                self.assertIn('Отложено до повтора: 1', out.getvalue())
+                self.assertEqual(claim_jobs(10), [])
+                job = ThumbnailJob.objects.get()
+                delays.append(job.locked_until - timezone.now())
+                job.locked_until = timezone.now()
+                job.save()
+        self.assertEqual(job.attempts, 2)
+        self.assertGreater(delays[0], timedelta(0))
+        self.assertGreater(delays[1], delays[0])
+
+    def test_worker_keeps_failed_jobs(self):
+        """Задание, исчерпавшее попытки, остаётся в базе проваленным"""
+        self.create_post('broken.gif', 40)
+        err = StringIO()
+        with mock.patch('posts.thumbnails.make_thumbnails',
+                        side_effect=OSError('диск недоступен')), \
+                mock.patch('posts.thumbnails.THUMBNAIL_JOB_ATTEMPTS', 1), \
+                self.assertLogs('posts.thumbnails', 'ERROR'):
+            call_command('thumbnail_worker', '--once', stdout=StringIO(),
+                         stderr=err)
+        self.assertIn('Не выполнено заданий: 1', err.getvalue())
+        job = ThumbnailJob.objects.get()
+        self.assertTrue(job.failed)
+        self.assertIn('диск недоступен', job.error)
+        out = StringIO()
+        call_command('thumbnail_worker', '--once', stdout=out)
+        self.assertIn('Обработано заданий: 0', out.getvalue())
+        call_command('thumbnail_worker', '--once', '--retry-failed',
+                     stdout=StringIO())
+        self.assertFalse(ThumbnailJob.objects.exists())
+
+    def test_warm_thumbnails(self):
+        """Прогрев режет миниатюры в пуле процессов и не повторяется"""
+        posts = [
+            Post.objects.create(
+                text='Прогрев', author=self.user,
+                image=gif(f'warm{i}.gif', 40 + i)
+            )
+            for i in range(3)
+        ]
+        out = StringIO()
+        call_command('warm_thumbnails', '--workers=2', '--batch=2',
+                     stdout=out)
+        self.assertIn('Миниатюры готовы: 3', out.getvalue())
+        for post in posts:
+            self.assertEqual(
+                len(cached_variants(post.image)), len(VARIANTS)
+            )
+        out = StringIO()
+        call_command('warm_thumbnails', '--workers=2', stdout=out)
+        self.assertIn('пропущено 3', out.getvalue())
+
+    def test_warm_thumbnails_force(self):
+        """С --force готовые миниатюры режутся заново под тем же именем"""
+        post = Post.objects.create(
+            text='Перерезать', author=self.user, image=gif('force.gif', 70)
+        )
+        call_command('warm_thumbnails', '--workers=1', stdout=StringIO())
+        thumbnails = [thumbnail for _, thumbnail in variant_files(post.image)]
+        for thumbnail in thumbnails:
+            with open(thumbnail.storage.path(thumbnail.name), 'wb') as file:
+                file.write(b'broken')
+        call_command('warm_thumbnails', '--workers=1', '--force',
+                     stdout=StringIO())
+        for thumbnail in thumbnails:
+            with open(thumbnail.storage.path(thumbnail.name), 'rb') as file:
+                self.assertNotEqual(file.read(), b'broken')
+
+    def test_warm_thumbnails_logs_failure(self):
+        """Упавшая картинка попадает в лог под своим именем"""
+        with mock.patch.object(warm_thumbnails, 'render_thumbnails',
+                               side_effect=OSError('битый файл')):
+            with self.assertLogs(warm_thumbnails.logger) as logs:
+                self.assertIsNone(warm_thumbnails._render('posts/bad.gif'))
+        self.assertIn('posts/bad.gif', logs.output[0])
+
+    def test_page_pictures_single_lookup(self):
+        """Миниатюры всей страницы ищутся одним запросом, а не по посту"""
+        for i in range(5):
+            Post.objects.create(
+                text='Страница', author=self.user,
+                image=gif(f'page{i}.gif', 50 + i)
+            )
+        call_command('warm_thumbnails', '--workers=1', stdout=StringIO())
+        posts = list(Post.objects.all())
+        cache.clear()
+        with self.assertNumQueries(1):
+            attach_pictures(posts)
+        with self.assertNumQueries(0):
+            attach_pictures(posts)
+        for post in posts:
+            self.assertIsNotNone(post.picture.fallback)
+        self.assertEqual(
+            post.picture.fallback.width, max(THUMBNAIL_WIDTHS)
+        )
+
+    def test_upload_stores_image_meta(self):
+        """При загрузке сохраняются размеры картинки и её превью"""
+        post = self.create_post('meta.gif', 60)
+        self.assertEqual((post.image_width, post.image_height), (2, 1))
+        self.assertTrue(
+            post.image_placeholder.startswith('data:image/jpeg;base64,')
+        )
+        response = self.client.get(
+            reverse('posts:post_detail', kwargs={'post_id': post.id})
+        )
+        self.assertContains(response, post.image_placeholder)
+        self.assertContains(response, 'loading="lazy"')
+        self.assertContains(response, 'width="960" height="339"')
+
+    def test_backfill_image_meta(self):
+        """Команда заполняет размеры и превью у старых постов"""
+        post = Post.objects.create(
+            text='Старый пост', author=self.user,
+            image=gif('old.gif', 70)
+        )
+        Post.objects.filter(pk=post.pk).update(image_width=None,
+                                               image_height=None)
+        self.assertIsNone(Post.objects.get(pk=post.pk).image_width)
+        call_command('backfill_image_meta', stdout=StringIO())
+        post.refresh_from_db()
+        self.assertEqual((post.image_width, post.image_height), (2, 1))
+        self.assertNotEqual(post.image_placeholder, '')
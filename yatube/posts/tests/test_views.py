@@ -1,16 +1,29 @@
 import shutil
 import tempfile
+from io import StringIO
+from unittest import mock
 from django.test import Client, TestCase, override_settings
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 from django import forms
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
 from django.db.models.fields.files import ImageFieldFile
 from django.conf import settings
 from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.sql import emit_post_migrate_signal
+from django.contrib.auth.models import AnonymousUser
 from rest_framework import status
-from ..models import Group, Post, Follow
-from ..constants import PER_PAGE
+from utils import KeysetPaginator
+from ..models import (Comment, Group, Post, Follow, PulledAuthor, Timeline,
+                      UserCounters)
+from ..admin import PostAdmin
+from ..caching import follow_feed_version
+from ..constants import COMMENTS_PER_PAGE, PER_PAGE
+from ..follows import followed_among, following_ids
+from ..profiles import _key as _profile_key, profile_summary
+from ..search import TRIGGERS, matching
 
 User = get_user_model()
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
@@ -225,6 +238,7 @@ class CacheTest(TestCase):
         )
 
     def setUp(self):
+        cache.clear()
         self.guest_client = Client()
         self.user = User.objects.create_user(username='NewUser')
         self.authorized_client = Client()
@@ -233,9 +247,9 @@ class CacheTest(TestCase):
     def test_index_page_cache(self):
         """Проверяем кэширование на главной странице"""
         response_1 = self.authorized_client.get(reverse('posts:index'))
-        post_1 = Post.objects.all()[0]
-        post_1.text = 'Новый тестовый текст'
-        post_1.save()
+        Post.objects.filter(pk=CacheTest.post.pk).update(
+            text='Новый тестовый текст'
+        )
         response_2 = self.authorized_client.get(reverse('posts:index'))
         cache.clear()
         response_3 = self.authorized_client.get(reverse('posts:index'))
@@ -243,6 +257,72 @@ class CacheTest(TestCase):
         self.assertEqual(response_1.content, response_2.content)
         self.assertNotEqual(response_1.content, response_3.content)
 
+    def test_index_cache_is_invalidated_on_save(self):
+        """Сохранение поста сбрасывает кэш главной страницы"""
+        self.authorized_client.get(reverse('posts:index'))
+        post = Post.objects.get(pk=CacheTest.post.pk)
+        post.text = 'Отредактированный текст'
+        post.save()
+        response = self.authorized_client.get(reverse('posts:index'))
+        self.assertContains(response, 'Отредактированный текст')
+
+    def test_cached_fragment_skips_feed_queries(self):
+        """Пока фрагмент ленты в кэше, лента не выбирается из базы"""
+        for url in (reverse('posts:index'), reverse('posts:follow_index')):
+            with mock.patch.object(KeysetPaginator, 'get_page',
+                                   autospec=True,
+                                   side_effect=KeysetPaginator.get_page
+                                   ) as get_page:
+                first = self.authorized_client.get(url)
+                second = self.authorized_client.get(url)
+            self.assertEqual(get_page.call_count, 1)
+            self.assertEqual(first.content, second.content)
+
+    def test_index_cache_is_invalidated_on_comment(self):
+        """Новый комментарий обновляет счётчик на карточке главной"""
+        for client in (self.authorized_client, self.guest_client):
+            client.get(reverse('posts:index'))
+        for count in (1, 2):
+            Comment.objects.create(post=CacheTest.post, author=self.user,
+                                   text='Комментарий')
+            for client in (self.authorized_client, self.guest_client):
+                response = client.get(reverse('posts:index'))
+                self.assertContains(response, f'Комментариев: {count}')
+
+    def test_comment_does_not_reset_follow_feeds(self):
+        """Комментарий не сбрасывает ленты подписчиков автора"""
+        Follow.objects.create(user=self.user, author=CacheTest.user)
+        version = follow_feed_version(self.user)
+        Comment.objects.create(post=CacheTest.post, author=self.user,
+                               text='Комментарий')
+        self.assertEqual(follow_feed_version(self.user), version)
+        response = self.authorized_client.get(reverse('posts:follow_index'))
+        self.assertNotContains(response, 'Комментариев:')
+
+    def test_index_cache_varies_by_page(self):
+        """Вторая страница главной не отдаётся из кэша первой"""
+        Post.objects.bulk_create(
+            Post(author=CacheTest.user, text='Пост ' + str(i))
+            for i in range(PER_PAGE)
+        )
+        cache.clear()
+        page_1 = self.authorized_client.get(reverse('posts:index'))
+        next_link = page_1.context['page_obj'].paginator.next_link
+        page_2 = self.authorized_client.get(reverse('posts:index')
+                                            + next_link)
+        self.assertContains(page_2, 'Тестовый текст')
+        self.assertNotContains(page_1, 'Тестовый текст')
+
+    def test_follow_cache_varies_by_user(self):
+        """Лента подписок одного читателя не показывается другому"""
+        Follow.objects.create(user=self.user, author=CacheTest.user)
+        self.authorized_client.get(reverse('posts:follow_index'))
+        stranger = User.objects.create_user(username='Stranger')
+        stranger_client = Client()
+        stranger_client.force_login(stranger)
+        response = stranger_client.get(reverse('posts:follow_index'))
+        self.assertNotContains(response, 'Тестовый текст')
+
 
 class FollowTest(TestCase):
     @classmethod
@@ -296,3 +376,700 @@ class FollowTest(TestCase):
         response_2 = self.not_following.get(reverse('posts:follow_index'))
         self.assertEqual(post_text, FollowTest.post.text)
         self.assertNotContains(response_2, FollowTest.post.text)
+
+
+class KeysetPaginatorTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='TestUser')
+        Post.objects.bulk_create(
+            Post(text='Пост ' + str(i), author=cls.user)
+            for i in range(PER_PAGE * 6 + 3)
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.guest_client = Client()
+
+    def walk(self, url):
+        """Проходит ленту по ссылкам «Следующая» и собирает id постов"""
+        seen, link = [], ''
+        while link is not None:
+            response = self.guest_client.get(url + link)
+            page_obj = response.context['page_obj']
+            seen.extend(post.pk for post in page_obj)
+            link = page_obj.paginator.next_link
+        return seen, page_obj
+
+    def test_cursor_walk_covers_feed(self):
+        """По курсорам ?after= лента проходится целиком и без повторов"""
+        seen, last_page = self.walk(reverse('posts:index'))
+        expected = list(Post.objects.order_by('-pub_date', '-pk')
+                        .values_list('pk', flat=True))
+        self.assertEqual(seen, expected)
+        self.assertEqual(last_page.number, 7)
+        self.assertFalse(last_page.has_next())
+
+    def test_previous_link_returns_same_page(self):
+        """Ссылка ?before= возвращает на предыдущую страницу"""
+        url = reverse('posts:index')
+        page_1 = self.guest_client.get(url).context['page_obj']
+        page_2 = self.guest_client.get(
+            url + page_1.paginator.next_link).context['page_obj']
+        back = self.guest_client.get(
+            url + page_2.paginator.previous_link).context['page_obj']
+        self.assertEqual([post.pk for post in back],
+                         [post.pk for post in page_1])
+        self.assertEqual(back.number, 1)
+
+    def test_window_is_bounded(self):
+        """Окно номеров страниц ограничено и не считает COUNT(*)"""
+        url = reverse('posts:index')
+        page_obj = self.guest_client.get(url).context['page_obj']
+        for _ in range(3):
+            page_obj = self.guest_client.get(
+                url + page_obj.paginator.next_link).context['page_obj']
+        numbers = [number for number, _, _ in
+                   page_obj.paginator.window_links]
+        self.assertEqual(page_obj.number, 4)
+        self.assertEqual(numbers, [1, 2, 3, 4, 5, 6])
+        self.assertTrue(page_obj.paginator.more_ahead)
+
+    def test_broken_cursor_opens_first_page(self):
+        """Испорченный курсор открывает первую страницу"""
+        response = self.guest_client.get(
+            reverse('posts:index') + '?after=broken')
+        self.assertEqual(response.context['page_obj'].number, 1)
+
+
+class TimelineTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='Author')
+        self.user = User.objects.create_user(username='Reader')
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+
+    def feed(self):
+        response = self.authorized_client.get(reverse('posts:follow_index'))
+        return [post.text for post in response.context['page_obj']]
+
+    def test_new_post_is_fanned_out(self):
+        """Новый пост автора записывается в ленты его подписчиков"""
+        Follow.objects.create(user=self.user, author=self.author)
+        Post.objects.create(author=self.author, text='Свежий пост')
+        self.assertTrue(Timeline.objects.filter(user=self.user).exists())
+        self.assertEqual(self.feed(), ['Свежий пост'])
+
+    def test_follow_backfills_and_unfollow_trims(self):
+        """Подписка добавляет старые посты в ленту, отписка убирает их"""
+        Post.objects.create(author=self.author, text='Старый пост')
+        self.authorized_client.get(reverse(
+            'posts:profile_follow', kwargs={'username': 'Author'}))
+        self.assertEqual(self.feed(), ['Старый пост'])
+        self.authorized_client.get(reverse(
+            'posts:profile_unfollow', kwargs={'username': 'Author'}))
+        self.assertEqual(self.feed(), [])
+        self.assertFalse(Timeline.objects.filter(user=self.user).exists())
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=0)
+    def test_popular_author_is_pulled_on_read(self):
+        """Посты автора с большим числом подписчиков подтягиваются
+        в ленту при чтении"""
+        Follow.objects.create(user=self.user, author=self.author)
+        Post.objects.create(author=self.author, text='Пост для всех')
+        self.assertTrue(
+            PulledAuthor.objects.filter(author=self.author).exists())
+        self.assertFalse(Timeline.objects.filter(user=self.user).exists())
+        self.assertEqual(self.feed(), ['Пост для всех'])
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=0)
+    def test_pull_writes_only_after_new_posts(self):
+        """Повторное чтение ленты без новых постов ничего не пишет"""
+        Follow.objects.create(user=self.user, author=self.author)
+        Post.objects.create(author=self.author, text='Первый')
+        self.feed()
+        with mock.patch.object(Timeline.objects, 'bulk_create') as create:
+            self.feed()
+        create.assert_not_called()
+        Post.objects.create(author=self.author, text='Второй')
+        self.assertEqual(self.feed(), ['Второй', 'Первый'])
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=2)
+    def test_author_is_demoted_when_followers_leave(self):
+        """Автор снова получает рассылку, когда подписчиков мало"""
+        others = [User.objects.create_user(username=f'Other{number}')
+                  for number in range(2)]
+        for user in (self.user, *others):
+            Follow.objects.create(user=user, author=self.author)
+        Post.objects.create(author=self.author, text='Подтягиваемый')
+        self.assertTrue(PulledAuthor.objects.exists())
+        Follow.objects.filter(user__in=others).delete()
+        self.assertFalse(PulledAuthor.objects.exists())
+        Post.objects.create(author=self.author, text='Разосланный')
+        self.assertEqual(Timeline.objects.filter(user=self.user).count(), 2)
+        self.assertEqual(self.feed(), ['Разосланный', 'Подтягиваемый'])
+
+
+class CountersTest(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username='Author')
+        self.user = User.objects.create_user(username='Reader')
+        self.group_1 = Group.objects.create(
+            title='Группа 1', slug='group-1', description='Описание')
+        self.group_2 = Group.objects.create(
+            title='Группа 2', slug='group-2', description='Описание')
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.author)
+
+    def counters(self, user):
+        return UserCounters.objects.get(user=user)
+
+    def test_post_counters(self):
+        """Создание и редактирование поста обновляют счётчики"""
+        self.authorized_client.post(reverse('posts:post_create'), data={
+            'text': 'Новый пост', 'group': self.group_1.pk})
+        post = Post.objects.get(text='Новый пост')
+        self.assertEqual(self.counters(self.author).posts_count, 1)
+        self.group_1.refresh_from_db()
+        self.assertEqual(self.group_1.posts_count, 1)
+
+        self.authorized_client.post(
+            reverse('posts:post_edit', kwargs={'post_id': post.pk}),
+            data={'text': 'Новый пост', 'group': self.group_2.pk})
+        self.group_1.refresh_from_db()
+        self.group_2.refresh_from_db()
+        self.assertEqual(self.group_1.posts_count, 0)
+        self.assertEqual(self.group_2.posts_count, 1)
+
+        post.refresh_from_db()
+        post.delete()
+        self.group_2.refresh_from_db()
+        self.assertEqual(self.group_2.posts_count, 0)
+        self.assertEqual(self.counters(self.author).posts_count, 0)
+
+    def test_group_change_outside_view(self):
+        """Смена группы любым сохранением поста правит счётчики групп"""
+        post = Post.objects.create(author=self.author, text='Пост',
+                                   group=self.group_1)
+        post.group = self.group_2
+        post.save()
+        self.group_1.refresh_from_db()
+        self.group_2.refresh_from_db()
+        self.assertEqual(self.group_1.posts_count, 0)
+        self.assertEqual(self.group_2.posts_count, 1)
+
+    def test_comment_and_follow_counters(self):
+        """Комментарии и подписки обновляют счётчики"""
+        post = Post.objects.create(author=self.author, text='Пост')
+        self.authorized_client.post(
+            reverse('posts:add_comment', kwargs={'post_id': post.pk}),
+            data={'text': 'Комментарий'})
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 1)
+
+        Follow.objects.create(user=self.user, author=self.author)
+        self.assertEqual(self.counters(self.author).followers_count, 1)
+        self.assertEqual(self.counters(self.user).following_count, 1)
+        Follow.objects.filter(user=self.user).delete()
+        self.assertEqual(self.counters(self.author).followers_count, 0)
+        self.assertEqual(self.counters(self.user).following_count, 0)
+
+    def test_recount_counters_repairs_drift(self):
+        """Команда recount_counters исправляет рассинхронизацию"""
+        post = Post.objects.create(author=self.author, text='Пост',
+                                   group=self.group_1)
+        Comment.objects.create(post=post, author=self.user, text='Текст')
+        Follow.objects.create(user=self.user, author=self.author)
+        UserCounters.objects.update(posts_count=7, followers_count=7)
+        Group.objects.update(posts_count=7)
+        Post.objects.update(comments_count=7)
+
+        call_command('recount_counters', stdout=StringIO())
+
+        self.assertEqual(self.counters(self.author).posts_count, 1)
+        self.assertEqual(self.counters(self.author).followers_count, 1)
+        self.assertEqual(self.counters(self.user).posts_count, 0)
+        self.group_1.refresh_from_db()
+        self.assertEqual(self.group_1.posts_count, 1)
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 1)
+
+
+class PostDetailQueriesTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='Author')
+        cls.group = Group.objects.create(
+            title='Группа', slug='detail-group', description='Описание')
+        cls.post = Post.objects.create(
+            author=cls.author, group=cls.group, text='Пост')
+        for i in range(COMMENTS_PER_PAGE + 5):
+            Comment.objects.create(
+                post=cls.post,
+                author=User.objects.create_user(username='u' + str(i)),
+                text='Комментарий ' + str(i)
+            )
+
+    def setUp(self):
+        cache.clear()
+        self.guest_client = Client()
+
+    def test_detail_query_count_does_not_grow(self):
+        """Валидатор, пост, автор, группа и комментарии читаются
+        фиксированным числом запросов"""
+        url = reverse('posts:post_detail', kwargs={'post_id': self.post.pk})
+        with self.assertNumQueries(4):
+            response = self.guest_client.get(url)
+        self.assertEqual(len(response.context['comments']),
+                         COMMENTS_PER_PAGE)
+
+    def test_load_more_comments(self):
+        """Фрагмент «показать ещё» отдаёт следующую порцию комментариев"""
+        response = self.guest_client.get(reverse(
+            'posts:post_detail', kwargs={'post_id': self.post.pk}))
+        next_link = response.context['comments'].paginator.next_link
+        fragment = self.guest_client.get(reverse(
+            'posts:post_comments', kwargs={'post_id': self.post.pk})
+            + next_link)
+        self.assertTemplateUsed(fragment, 'posts/includes/comment_list.html')
+        self.assertEqual(len(fragment.context['comments']), 5)
+        self.assertContains(fragment, 'Комментарий 0')
+        self.assertFalse(fragment.context['comments'].has_next())
+
+
+class ProfileSummaryTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='Author')
+        self.user = User.objects.create_user(username='Reader')
+        Post.objects.create(author=self.author, text='Пост')
+
+    def test_cached_entry_has_no_secrets(self):
+        """В кэше шапки профиля нет хэша пароля и почты"""
+        self.author.email = 'author@example.com'
+        self.author.set_password('secret')
+        self.author.save()
+        profile_summary('Author', AnonymousUser())
+        cached = repr(cache.get(_profile_key('Author')))
+        self.assertNotIn('author@example.com', cached)
+        self.assertNotIn(self.author.password, cached)
+        summary = profile_summary('Author', AnonymousUser())
+        self.assertEqual(summary.author, self.author)
+        self.assertEqual(summary.counters.posts_count, 1)
+
+    def test_renamed_or_deleted_author(self):
+        """После переименования и удаления старый профиль отдаёт 404"""
+        url = reverse('posts:profile', kwargs={'username': 'Author'})
+        self.client.get(url)
+        self.author.username = 'Writer'
+        self.author.first_name = 'Новое имя'
+        self.author.save()
+        self.assertEqual(self.client.get(url).status_code,
+                         status.HTTP_404_NOT_FOUND)
+        url = reverse('posts:profile', kwargs={'username': 'Writer'})
+        self.assertContains(self.client.get(url), 'Новое имя')
+        self.author.delete()
+        self.assertEqual(self.client.get(url).status_code,
+                         status.HTTP_404_NOT_FOUND)
+
+    def test_unknown_username_is_404(self):
+        """Профиль несуществующего пользователя отдаёт 404"""
+        response = self.client.get(reverse(
+            'posts:profile', kwargs={'username': 'nobody'}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_header_is_cached(self):
+        """Повторная шапка профиля читается из кэша"""
+        with self.assertNumQueries(1):
+            profile_summary('Author', self.user)
+        with self.assertNumQueries(0):
+            summary = profile_summary('Author', AnonymousUser())
+        with self.assertNumQueries(1):
+            profile_summary('Author', self.user)
+        with self.assertNumQueries(0):
+            profile_summary('Author', self.user)
+        self.assertEqual(summary.counters.posts_count, 1)
+        self.assertFalse(summary.following)
+
+    def test_follow_invalidates_header(self):
+        """Подписка сбрасывает кэш шапки и меняет счётчики"""
+        profile_summary('Author', self.user)
+        Follow.objects.create(user=self.user, author=self.author)
+        summary = profile_summary('Author', self.user)
+        self.assertTrue(summary.following)
+        self.assertEqual(summary.counters.followers_count, 1)
+
+
+class FollowGraphTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='Reader')
+        self.authors = [User.objects.create_user(username='Author' + str(i))
+                        for i in range(3)]
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+
+    def test_followed_among_uses_cached_set(self):
+        """Подписки на N авторов проверяются одним обращением к кэшу"""
+        Follow.objects.create(user=self.user, author=self.authors[0])
+        ids = [author.pk for author in self.authors]
+        with self.assertNumQueries(1):
+            followed_among(self.user, ids)
+        with self.assertNumQueries(0):
+            followed = followed_among(self.user, ids)
+        self.assertEqual(followed, {self.authors[0].pk})
+
+    def test_follow_views_reset_cached_set(self):
+        """Подписка и отписка сбрасывают закэшированное множество"""
+        following_ids(self.user)
+        self.authorized_client.get(reverse(
+            'posts:profile_follow', kwargs={'username': 'Author1'}))
+        with self.assertNumQueries(1):
+            self.assertIn(self.authors[1].pk, following_ids(self.user))
+        self.authorized_client.get(reverse(
+            'posts:profile_unfollow', kwargs={'username': 'Author1'}))
+        self.assertNotIn(self.authors[1].pk, following_ids(self.user))
+
+    def test_index_cards_show_follow_state(self):
+        """Карточки главной показывают подписку на автора"""
+        Follow.objects.create(user=self.user, author=self.authors[0])
+        for author in self.authors:
+            Post.objects.create(author=author, text='Пост ' + author.username)
+        response = self.authorized_client.get(reverse('posts:index'))
+        self.assertContains(response, 'Вы подписаны на автора', count=1)
+        self.assertContains(response, 'подписаться на автора', count=2)
+
+
+class SearchTest(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username='Writer')
+        self.relevant = Post.objects.create(
+            author=self.author, text='Ёжик ёжик ёжик в тумане'
+        )
+        self.other = Post.objects.create(
+            author=self.author, text='Ёжик и медвежонок пьют чай'
+        )
+        Post.objects.create(author=self.author, text='Совсем про другое')
+
+    def search(self, **params):
+        return self.client.get(reverse('posts:search'), params)
+
+    def test_ranked_prefix_search(self):
+        """Поиск находит по префиксу без учёта ё и ранжирует по bm25"""
+        response = self.search(q='ежи')
+        self.assertEqual(response.context['posts'],
+                         [self.relevant, self.other])
+
+    def test_cursor_pagination(self):
+        """Следующая страница продолжает выдачу после курсора"""
+        for number in range(PER_PAGE):
+            Post.objects.create(author=self.author, text=f'ёжик {number}')
+        response = self.search(q='ёжик')
+        first = response.context['posts']
+        self.assertEqual(len(first), PER_PAGE)
+        response = self.client.get(
+            reverse('posts:search') + response.context['next_link']
+        )
+        rest = response.context['posts']
+        self.assertEqual(len(rest), 2)
+        self.assertFalse(set(first) & set(rest))
+        self.assertIsNone(response.context['next_link'])
+
+    def test_index_follows_edits_and_deletes(self):
+        """Триггеры обновляют индекс при правке и удалении поста"""
+        self.other.text = 'Медвежонок пьёт чай'
+        self.other.save()
+        self.assertEqual(self.search(q='ежик').context['posts'],
+                         [self.relevant])
+        self.assertEqual(self.search(q='медвежонок').context['posts'],
+                         [self.other])
+        self.relevant.delete()
+        self.assertEqual(self.search(q='ежик').context['posts'], [])
+
+    def test_migrate_restores_triggers(self):
+        """После migrate пропавшие триггеры ставятся и индекс догоняет"""
+        with connection.cursor() as db:
+            for name in TRIGGERS:
+                db.execute(f'DROP TRIGGER {name}')
+        lost = Post.objects.create(author=self.author, text='Ёжик потерялся')
+        self.assertNotIn(lost, self.search(q='потерялся').context['posts'])
+        emit_post_migrate_signal(0, False, connection.alias)
+        self.assertEqual(self.search(q='потерялся').context['posts'], [lost])
+        edited = Post.objects.create(author=self.author, text='Новый ёжик')
+        edited.text = 'Новый медвежонок'
+        edited.save()
+        self.assertCountEqual(self.search(q='медвежонок').context['posts'],
+                              [self.other, edited])
+        self.assertEqual(self.search(q='новый ежик').context['posts'], [])
+
+    def test_operators_are_not_interpreted(self):
+        """Синтаксис FTS5 во вводе не ломает поиск"""
+        response = self.search(q='ёжик" OR NEAR(')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.context['posts'], [])
+
+    def test_rebuild_and_admin_search(self):
+        """Команда перестраивает индекс, админка ищет по нему"""
+        call_command('rebuild_search_index', stdout=StringIO())
+        admin = User.objects.create_superuser('admin', 'a@a.ru', 'pass')
+        self.client.force_login(admin)
+        response = self.client.get(
+            reverse('admin:posts_post_changelist'), {'q': 'медвежонок'}
+        )
+        self.assertEqual(list(response.context['cl'].result_list),
+                         [self.other])
+        response = self.client.get(
+            reverse('admin:posts_post_changelist'), {'q': 'ежик'}
+        )
+        self.assertEqual(set(response.context['cl'].result_list),
+                         {self.relevant, self.other})
+        self.assertEqual(matching(Post.objects.all(), 'ежик').count(), 2)
+
+
+class PostAdminTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='Writer')
+        self.source = Group.objects.create(title='Из', slug='source')
+        self.target = Group.objects.create(title='В', slug='target')
+        self.posts = [
+            Post.objects.create(author=self.author, group=self.source,
+                                text='Очень длинный текст поста ' * 10)
+            for _ in range(3)
+        ]
+        admin = User.objects.create_superuser('admin', 'a@a.ru', 'pass')
+        self.client.force_login(admin)
+        self.url = reverse('admin:posts_post_changelist')
+
+    @mock.patch.object(PostAdmin, 'list_per_page', 2)
+    def test_keyset_pages(self):
+        """Без сортировки по столбцу список листается по курсору"""
+        cl = self.client.get(self.url).context['cl']
+        self.assertTrue(cl.keyset)
+        self.assertEqual(list(cl.result_list), self.posts[:0:-1])
+        links = {number: link for number, link, _ in cl.keyset_window}
+        self.assertIn('after=', links[2])
+        cl = self.client.get(self.url + links[2]).context['cl']
+        self.assertEqual(list(cl.result_list), [self.posts[0]])
+
+    def test_truncated_text_and_cached_count(self):
+        """Текст в списке обрезан, число постов берётся из кэша"""
+        response = self.client.get(self.url)
+        self.assertEqual(response.context['cl'].result_count, 3)
+        self.assertContains(response, 'Очень длинный текст поста Очень')
+        self.assertNotContains(response, self.posts[0].text)
+        Post.objects.create(author=self.author, text='Ещё один')
+        response = self.client.get(self.url)
+        self.assertEqual(response.context['cl'].result_count, 3)
+
+    def test_move_to_group(self):
+        """Действие переносит посты в группу и правит счётчики"""
+        data = {
+            'action': 'move_to_group',
+            'index': 0,
+            '_selected_action': [post.pk for post in self.posts[:2]],
+        }
+        response = self.client.post(self.url, data)
+        self.assertContains(response, 'Выбрано постов: 2')
+        self.assertEqual(self.source.posts.count(), 3)
+        response = self.client.post(
+            self.url, {**data, 'apply': '1', 'group': self.target.pk}
+        )
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+        self.assertEqual(self.target.posts.count(), 2)
+        self.source.refresh_from_db()
+        self.target.refresh_from_db()
+        self.assertEqual(self.source.posts_count, 1)
+        self.assertEqual(self.target.posts_count, 2)
+
+
+class ApiTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='Writer')
+        self.reader = User.objects.create_user(username='Reader')
+        self.group = Group.objects.create(title='Группа', slug='group')
+        self.posts = [
+            Post.objects.create(author=self.author, group=self.group,
+                                text=f'Пост {number}')
+            for number in range(PER_PAGE + 2)
+        ]
+        Comment.objects.create(post=self.posts[0], author=self.reader,
+                               text='Комментарий')
+
+    def get(self, name, *args, **params):
+        return self.client.get(reverse(f'posts:{name}', args=args), params)
+
+    def test_cursor_pagination(self):
+        """Следующая страница продолжает выдачу после курсора"""
+        response = self.get('api_index')
+        page = response.json()
+        self.assertEqual(len(page['results']), PER_PAGE)
+        self.assertEqual(page['results'][0]['id'], self.posts[-1].pk)
+        self.assertEqual(page['results'][0]['author'], 'Writer')
+        rest = self.client.get(page['next']).json()
+        self.assertEqual([post['id'] for post in rest['results']],
+                         [self.posts[1].pk, self.posts[0].pk])
+        self.assertIsNone(rest['next'])
+
+    def test_sparse_fieldsets(self):
+        """Отдаются только запрошенные поля, неизвестные отвергаются"""
+        page = self.get('api_group', 'group', fields='id,text',
+                        limit=1).json()
+        self.assertEqual(page['results'],
+                         [{'id': self.posts[-1].pk, 'text': 'Пост 11'}])
+        self.assertEqual(page['group']['posts_count'], PER_PAGE + 2)
+        self.assertIn('fields=id%2Ctext', page['next'])
+        response = self.get('api_index', fields='id,password')
+        self.assertEqual(response.status_code,
+                         status.HTTP_400_BAD_REQUEST)
+
+    def test_profile_follow_and_detail(self):
+        """Профиль, лента подписок и пост с комментариями"""
+        page = self.get('api_profile', 'Writer', fields='id').json()
+        self.assertEqual(page['author']['posts_count'], PER_PAGE + 2)
+        self.assertEqual(self.get('api_follow').status_code,
+                         status.HTTP_401_UNAUTHORIZED)
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.client.force_login(self.reader)
+        page = self.get('api_follow', fields='id').json()
+        self.assertEqual(page['results'][0], {'id': self.posts[-1].pk})
+        post = self.get('api_post_detail', self.posts[0].pk).json()
+        self.assertEqual(post['text'], 'Пост 0')
+        self.assertEqual(post['comments']['results'][0]['author'], 'Reader')
+        self.assertEqual(self.get('api_post_detail', 0).status_code,
+                         status.HTTP_404_NOT_FOUND)
+
+
+class ConditionalGetTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='Writer')
+        self.reader = User.objects.create_user(username='Reader')
+        self.group = Group.objects.create(title='Группа', slug='group')
+        self.post = Post.objects.create(author=self.author, group=self.group,
+                                        text='Пост')
+
+    def assertNotModified(self, url, changed, client=None):
+        client = client or self.client
+        etag = client.get(url)['ETag']
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code,
+                         status.HTTP_304_NOT_MODIFIED)
+        self.assertFalse(response.content)
+        changed()
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_index_and_group(self):
+        """Новый или удалённый пост меняет ETag ленты"""
+        self.assertNotModified(reverse('posts:index'), lambda: (
+            Post.objects.create(author=self.author, text='Новый')
+        ))
+        self.assertNotModified(
+            reverse('posts:group_list', args=('group',)), self.post.delete
+        )
+
+    def test_group_header_changes_etag(self):
+        """Правка названия или описания группы меняет ETag её страницы"""
+        url = reverse('posts:group_list', args=('group',))
+        for field in ('title', 'description'):
+            setattr(self.group, field, 'Новое значение')
+            self.assertNotModified(url, self.group.save)
+
+    def test_profile_follow_changes_etag(self):
+        """Подписка меняет ETag профиля у подписчика"""
+        client = Client()
+        client.force_login(self.reader)
+        self.assertNotModified(
+            reverse('posts:profile', args=('Writer',)),
+            lambda: Follow.objects.create(user=self.reader,
+                                          author=self.author),
+            client
+        )
+
+    def test_post_detail(self):
+        """Новый комментарий меняет ETag и Last-Modified поста"""
+        url = reverse('posts:post_detail', args=(self.post.pk,))
+        self.assertNotModified(url, lambda: Comment.objects.create(
+            post=self.post, author=self.reader, text='Комментарий'
+        ))
+        response = self.client.get(url)
+        response = self.client.get(
+            url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']
+        )
+        self.assertEqual(response.status_code,
+                         status.HTTP_304_NOT_MODIFIED)
+
+
+class PageCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='Writer')
+        self.reader = User.objects.create_user(username='Reader')
+        self.group = Group.objects.create(title='Группа', slug='group')
+        self.other = Group.objects.create(title='Другая', slug='other')
+        self.post = Post.objects.create(author=self.author, group=self.group,
+                                        text='Пост')
+        self.urls = {
+            'index': reverse('posts:index'),
+            'group': reverse('posts:group_list', args=('group',)),
+            'other': reverse('posts:group_list', args=('other',)),
+            'profile': reverse('posts:profile', args=('Writer',)),
+            'reader': reverse('posts:profile', args=('Reader',)),
+            'detail': reverse('posts:post_detail', args=(self.post.pk,)),
+        }
+        for url in self.urls.values():
+            self.client.get(url)
+
+    def cached(self):
+        """Имена страниц, которые гость сейчас получает из кэша."""
+        return {name for name, url in self.urls.items()
+                if self.client.get(url).context is None}
+
+    def test_anonymous_hit_skips_view(self):
+        """Повторный запрос гостя отдаётся из кэша без запросов к БД"""
+        with self.assertNumQueries(0):
+            response = self.client.get(self.urls['detail'])
+        self.assertIsNone(response.context)
+        self.assertContains(response, 'Пост')
+        self.assertEqual(
+            self.client.get(self.urls['detail'],
+                            HTTP_IF_NONE_MATCH=response['ETag']).status_code,
+            status.HTTP_304_NOT_MODIFIED
+        )
+
+    def test_comment_purges_post_keys(self):
+        """Комментарий сбрасывает только страницы, где виден пост"""
+        Comment.objects.create(post=self.post, author=self.reader,
+                               text='Комментарий')
+        self.assertEqual(self.cached(), {'other', 'reader'})
+
+    def test_edit_purges_old_and_new_group(self):
+        """Перенос поста сбрасывает страницы обеих групп"""
+        self.post.group = self.other
+        self.post.save()
+        self.assertEqual(self.cached(), {'reader'})
+
+    def test_author_name_purges_cards(self):
+        """Новое имя автора видно на главной и в его группах"""
+        self.author.first_name = 'Новое имя'
+        self.author.save()
+        self.assertEqual(self.cached(), {'other', 'reader'})
+        for name in ('index', 'group', 'profile', 'detail'):
+            self.assertContains(self.client.get(self.urls[name]),
+                                'Новое имя')
+
+    def test_follow_purges_both_profiles(self):
+        """Подписка сбрасывает профили автора и подписчика"""
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.assertEqual(self.cached(), {'index', 'group', 'other'})
+
+    def test_authorized_pages_are_not_cached(self):
+        """Вошедшему пользователю страница всегда рендерится"""
+        self.client.force_login(self.reader)
+        self.client.get(self.urls['index'])
+        self.assertIsNotNone(self.client.get(self.urls['index']).context)
@@ -0,0 +1,356 @@
+import logging
+import traceback
+from base64 import b64encode
+from collections import namedtuple
+from datetime import timedelta
+from io import BytesIO
+from uuid import uuid4
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from PIL import Image, features
+from sorl.thumbnail import default
+from sorl.thumbnail.conf import defaults as default_settings
+from sorl.thumbnail.conf import settings as thumbnail_settings
+from sorl.thumbnail.helpers import deserialize, serialize
+from sorl.thumbnail.images import ImageFile, deserialize_image_file
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.kvstores import cached_db_kvstore
+from sorl.thumbnail.models import KVStore as KVStoreModel
+from .caching import invalidate_post
+from .constants import (IMAGE_PLACEHOLDER_SIZE, THUMBNAIL_FORMATS,
+                        THUMBNAIL_JOB_ATTEMPTS, THUMBNAIL_JOB_BACKOFF,
+                        THUMBNAIL_JOB_LEASE, THUMBNAIL_OPTIONS,
+                        THUMBNAIL_RATIO, THUMBNAIL_WIDTHS)
+from .models import Post, ThumbnailJob
+from .pagecache import purge_post_ids
+
+logger = logging.getLogger(__name__)
+
+Variant = namedtuple('Variant', 'width format geometry options')
+Picture = namedtuple(
+    'Picture', 'fallback srcset sources placeholder width height'
+)
+
+MIME_TYPES = {'WEBP': 'image/webp', 'JPEG': 'image/jpeg'}
+JOB_DONE, JOB_RETRY, JOB_FAILED = 'done', 'retry', 'failed'
+
+
+def _options(source, options):
+    """Дополняет опции так же, как sorl перед расчётом имени файла."""
+    options = dict(options)
+    backend = default.backend
+    if thumbnail_settings.THUMBNAIL_PRESERVE_FORMAT:
+        options.setdefault('format', backend._get_format(source))
+    for key, value in backend.default_options.items():
+        options.setdefault(key, value)
+    for key, attr in backend.extra_options:
+        value = getattr(thumbnail_settings, attr)
+        if value != getattr(default_settings, attr):
+            options.setdefault(key, value)
+    return options
+
+
+def _supported(format_):
+    return format_ != 'WEBP' or features.check('webp')
+
+
+VARIANTS = tuple(
+    Variant(width, format_, f'{width}x{round(width * THUMBNAIL_RATIO)}',
+            {**THUMBNAIL_OPTIONS, 'format': format_})
+    for format_ in THUMBNAIL_FORMATS if _supported(format_)
+    for width in THUMBNAIL_WIDTHS
+)
+
+
+def source_file(image):
+    """Исходник для sorl в хранилище поля Post.image.
+
+    Ключи KV-хранилища зависят от хранилища исходника, поэтому имя из
+    values_list и FieldFile должны давать один и тот же ImageFile.
+    """
+    return ImageFile(image, Post._meta.get_field('image').storage)
+
+
+def variant_files(image):
+    """Пары (вариант, файл миниатюры) картинки без обращения к файлам."""
+    source = source_file(image)
+    files = []
+    for variant in VARIANTS:
+        name = default.backend._get_thumbnail_filename(
+            source, variant.geometry, _options(source, variant.options)
+        )
+        files.append((variant, ImageFile(name, default.storage)))
+    return files
+
+
+def image_placeholder(file_):
+    """Крошечная копия картинки в виде data: URI для размытого превью."""
+    file_.seek(0)
+    with Image.open(file_) as image:
+        image.draft('RGB', (IMAGE_PLACEHOLDER_SIZE * 8,) * 2)
+        image = image.convert('RGB')
+        image.thumbnail((IMAGE_PLACEHOLDER_SIZE, IMAGE_PLACEHOLDER_SIZE))
+        buffer = BytesIO()
+        image.save(buffer, 'JPEG', quality=50)
+    file_.seek(0)
+    return 'data:image/jpeg;base64,' + b64encode(buffer.getvalue()).decode()
+
+
+def _stored_values(keys):
+    """Значения ключей KV-хранилища sorl за один проход.
+
+    Для хранилища в базе это один get_many к кэшу и не больше одного
+    запроса за промахами; промахи кэшируются так же, как в sorl.
+    """
+    kvstore = default.kvstore
+    if not isinstance(kvstore, cached_db_kvstore.KVStore):
+        return {key: value for key, value in (
+            (key, kvstore._get_raw(key)) for key in keys
+        ) if value}
+    values = kvstore.cache.get_many(keys)
+    missing = [key for key in keys if key not in values]
+    if missing:
+        found = dict(KVStoreModel.objects.filter(
+            key__in=missing
+        ).values_list('key', 'value'))
+        kvstore.cache.set_many(
+            {key: found.get(key, cached_db_kvstore.EMPTY_VALUE)
+             for key in missing},
+            thumbnail_settings.THUMBNAIL_CACHE_TIMEOUT
+        )
+        values.update(found)
+    return {key: value for key, value in values.items()
+            if value != cached_db_kvstore.EMPTY_VALUE}
+
+
+def cached_variants_many(images):
+    """Готовые варианты миниатюр сразу для нескольких картинок.
+
+    В отличие от {% thumbnail %} никогда не открывает и не уменьшает
+    исходные картинки, поэтому безопасна для вызова во время запроса.
+    Возвращает словарь имя картинки -> пары (вариант, миниатюра)
+    только для готовых вариантов.
+    """
+    files = {image.name: variant_files(image) for image in images if image}
+    values = _stored_values([
+        add_prefix(file_.key)
+        for image_files in files.values() for _, file_ in image_files
+    ])
+    return {
+        name: [
+            (variant, deserialize_image_file(values[add_prefix(file_.key)]))
+            for variant, file_ in image_files
+            if add_prefix(file_.key) in values
+        ]
+        for name, image_files in files.items()
+    }
+
+
+def cached_variants(image):
+    """Готовые варианты миниатюры одной картинки."""
+    if not image:
+        return []
+    return cached_variants_many([image])[image.name]
+
+
+def picture(variants, placeholder=''):
+    """Данные для <picture>: запасная JPEG-миниатюра, srcset и размеры."""
+    width = max(THUMBNAIL_WIDTHS)
+    height = round(width * THUMBNAIL_RATIO)
+    srcsets, fallback = {}, None
+    for variant, thumbnail in variants:
+        srcsets.setdefault(variant.format, []).append(
+            f'{thumbnail.url} {variant.width}w'
+        )
+        if variant.format == 'JPEG':
+            fallback = thumbnail
+            width, height = thumbnail.width, thumbnail.height
+    return Picture(
+        fallback=fallback,
+        placeholder=placeholder,
+        width=width,
+        height=height,
+        srcset=', '.join(srcsets.pop('JPEG', [])),
+        sources=[(MIME_TYPES[format_], ', '.join(srcset))
+                 for format_, srcset in srcsets.items()]
+    )
+
+
+def attach_pictures(posts):
+    """Заполняет post.picture для всех постов страницы одним multi-get."""
+    posts = list(posts)
+    variants = cached_variants_many(post.image for post in posts)
+    for post in posts:
+        post.picture = None
+        if post.image:
+            post.picture = picture(
+                variants[post.image.name], post.image_placeholder
+            )
+    return posts
+
+
+def _stored_keys(keys):
+    """Какие из ключей есть в KV-хранилище; кэш sorl не засоряется."""
+    if isinstance(default.kvstore, cached_db_kvstore.KVStore):
+        return set(KVStoreModel.objects.filter(
+            key__in=keys
+        ).values_list('key', flat=True))
+    return {key for key in keys if default.kvstore._get_raw(key)}
+
+
+def missing_thumbnails(images):
+    """Картинки, у которых в KV-хранилище sorl готовы не все варианты."""
+    keys = {
+        image: [add_prefix(file_.key) for _, file_ in variant_files(image)]
+        for image in images
+    }
+    stored = _stored_keys(
+        [key for image_keys in keys.values() for key in image_keys]
+    )
+    return [image for image in images
+            if not stored.issuperset(keys[image])]
+
+
+def known_thumbnails(names):
+    """Файлы миниатюр из names, о которых знает KV-хранилище sorl."""
+    keys = {
+        name: add_prefix(ImageFile(name, default.storage).key)
+        for name in names
+    }
+    stored = _stored_keys(list(keys.values()))
+    return {name for name, key in keys.items() if key in stored}
+
+
+def render_thumbnails(image, overwrite=False):
+    """Режет все варианты миниатюры, не трогая базу и KV-хранилище.
+
+    Исходник декодируется один раз. Годится для запуска в пуле
+    процессов: возвращает сериализованные пары для store_thumbnails.
+    С overwrite готовые файлы миниатюр удаляются и режутся заново.
+    """
+    source = source_file(image)
+    source_image = default.engine.get_image(source)
+    rendered = []
+    try:
+        image_info = default.engine.get_image_info(source_image)
+        source.set_size(default.engine.get_image_size(source_image))
+        for variant, thumbnail in variant_files(image):
+            # Как и sorl, не перезаписываем готовый файл: иначе хранилище
+            # сохранит его под другим именем, а ключ останется прежним.
+            # Поэтому при overwrite старый файл сначала удаляется.
+            if overwrite and thumbnail.exists():
+                thumbnail.delete()
+            if (thumbnail_settings.THUMBNAIL_FORCE_OVERWRITE
+                    or not thumbnail.exists()):
+                options = _options(source, variant.options)
+                options['image_info'] = image_info
+                default.backend._create_thumbnail(
+                    source_image, variant.geometry, options, thumbnail
+                )
+            thumbnail.set_size()
+            rendered.append((source.serialize(), thumbnail.serialize()))
+    finally:
+        default.engine.cleanup(source_image)
+    return rendered
+
+
+def make_thumbnails(image):
+    """Режет все варианты миниатюры и записывает их в KV-хранилище."""
+    store_thumbnails(render_thumbnails(image))
+
+
+def store_thumbnails(rendered):
+    """Записывает результаты render_thumbnail в KV-хранилище пачкой.
+
+    Для хранилища в базе это одна транзакция с bulk_create вместо
+    нескольких запросов на каждую картинку.
+    """
+    pairs = [(deserialize_image_file(source), deserialize_image_file(thumb))
+             for source, thumb in rendered]
+    kvstore = default.kvstore
+    if not isinstance(kvstore, cached_db_kvstore.KVStore):
+        for source, thumbnail in pairs:
+            kvstore.get_or_set(source)
+            kvstore.set(thumbnail, source)
+        return
+    values, thumbnails = {}, {}
+    for source, thumbnail in pairs:
+        values[add_prefix(source.key)] = source.serialize()
+        values[add_prefix(thumbnail.key)] = thumbnail.serialize()
+        thumbnails.setdefault(
+            add_prefix(source.key, 'thumbnails'), set()
+        ).add(thumbnail.key)
+    with transaction.atomic():
+        for key, value in KVStoreModel.objects.filter(
+            key__in=thumbnails
+        ).values_list('key', 'value'):
+            thumbnails[key].update(deserialize(value))
+        for key, keys in thumbnails.items():
+            values[key] = serialize(sorted(keys))
+        KVStoreModel.objects.filter(key__in=values).delete()
+        KVStoreModel.objects.bulk_create(
+            KVStoreModel(key=key, value=value)
+            for key, value in values.items()
+        )
+    kvstore.cache.set_many(values, thumbnail_settings.THUMBNAIL_CACHE_TIMEOUT)
+
+
+def enqueue_thumbnail(post):
+    """Ставит подготовку миниатюры поста в очередь.
+
+    Для уже известного содержимого миниатюры готовы и очередь не нужна.
+    """
+    if post.image and missing_thumbnails([post.image]):
+        ThumbnailJob.objects.create(post=post)
+
+
+def claim_jobs(limit):
+    """Забирает до limit свободных заданий под аренду этого обработчика."""
+    now = timezone.now()
+    free = Q(locked_until__isnull=True) | Q(locked_until__lt=now)
+    ids = list(ThumbnailJob.objects.filter(free, failed=False).values_list(
+        'id', flat=True
+    )[:limit])
+    token = uuid4().hex
+    ThumbnailJob.objects.filter(free, id__in=ids).update(
+        locked_by=token,
+        locked_until=now + timedelta(seconds=THUMBNAIL_JOB_LEASE)
+    )
+    return list(ThumbnailJob.objects.select_related('post').filter(
+        locked_by=token
+    ))
+
+
+def run_job(job):
+    """Выполняет задание и возвращает JOB_DONE, JOB_RETRY или JOB_FAILED.
+
+    При ошибке задание возвращается в очередь после паузы, которая
+    удваивается с каждой попыткой; исчерпав попытки, оно остаётся
+    в базе с текстом ошибки и больше не забирается, пока его
+    не перезапустят (thumbnail_worker --retry-failed).
+    """
+    try:
+        if job.post.image:
+            make_thumbnails(job.post.image)
+            Post.objects.filter(pk=job.post_id).update(
+                modified=timezone.now()
+            )
+            invalidate_post(job.post)
+            purge_post_ids(job.post_id)
+    except Exception:
+        logger.exception('Не удалось подготовить миниатюру поста %s',
+                         job.post_id)
+        attempts = job.attempts + 1
+        failed = attempts >= THUMBNAIL_JOB_ATTEMPTS
+        retry_at = None if failed else timezone.now() + timedelta(
+            seconds=THUMBNAIL_JOB_BACKOFF * 2 ** (attempts - 1)
+        )
+        ThumbnailJob.objects.filter(pk=job.pk).update(
+            attempts=attempts, locked_by='', locked_until=retry_at,
+            failed=failed, error=traceback.format_exc()
+        )
+        return JOB_FAILED if failed else JOB_RETRY
+    job.delete()
+    return JOB_DONE
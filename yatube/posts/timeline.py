@@ -0,0 +1,164 @@
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import Follow, Post, PulledAuthor, Timeline
+
+BATCH_SIZE = 500
+
+
+def _entries(user_id, posts):
+    return (
+        Timeline(user_id=user_id, post_id=post_id, author_id=author_id,
+                 pub_date=pub_date)
+        for post_id, author_id, pub_date in posts
+    )
+
+
+def _pull_key(user_id):
+    return f'timeline_pull:{user_id}'
+
+
+def _mark_key(author_id):
+    return f'timeline_mark:{author_id}'
+
+
+def _touch_mark(author_id):
+    """Отмечает, что у подтягиваемого автора появился пост."""
+    key = _mark_key(author_id)
+    cache.set(key, uuid4().hex, None)
+    # Ещё раз после коммита: подтянувший ленту до коммита поста не видел.
+    transaction.on_commit(lambda: cache.set(key, uuid4().hex, None))
+
+
+def _recent_posts(authors, since=None):
+    posts = Post.objects.filter(author__in=authors)
+    if since is not None:
+        posts = posts.filter(pub_date__gte=since)
+    return posts.order_by('-pub_date', '-id').values_list(
+        'id', 'author', 'pub_date'
+    )[:settings.TIMELINE_BACKFILL_LIMIT]
+
+
+def fan_out(post):
+    """Рассылает новый пост в ленты подписчиков автора.
+
+    Если подписчиков больше TIMELINE_FANOUT_LIMIT, автор помечается
+    как «подтягиваемый»: его посты попадут в ленту при чтении.
+    """
+    if post.author_id is None:
+        return
+    if PulledAuthor.objects.filter(author_id=post.author_id).exists():
+        _touch_mark(post.author_id)
+        return
+    followers = Follow.objects.filter(author_id=post.author_id)
+    if followers.count() > settings.TIMELINE_FANOUT_LIMIT:
+        PulledAuthor.objects.get_or_create(author_id=post.author_id)
+        _touch_mark(post.author_id)
+        return
+    Timeline.objects.bulk_create(
+        (Timeline(user_id=user_id, post=post, author_id=post.author_id,
+                  pub_date=post.pub_date)
+         for user_id in followers.values_list('user', flat=True)),
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True
+    )
+
+
+def refresh(post):
+    """Обновляет копии полей поста в уже разосланных записях ленты."""
+    Timeline.objects.filter(post=post).exclude(
+        pub_date=post.pub_date, author_id=post.author_id
+    ).update(pub_date=post.pub_date, author_id=post.author_id)
+
+
+def backfill(user_id, author_id):
+    """Добавляет в ленту последние посты автора после подписки."""
+    Timeline.objects.bulk_create(
+        _entries(user_id, _recent_posts([author_id])),
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True
+    )
+
+
+def trim(user_id, author_id):
+    """Убирает из ленты посты автора после отписки."""
+    Timeline.objects.filter(user_id=user_id, author_id=author_id).delete()
+
+
+def pull(user):
+    """Подтягивает в ленту посты авторов, которым рассылка не делается.
+
+    У каждого такого автора в кэше есть метка, которая меняется с новым
+    постом. Строки ленты пишутся только для авторов, чья метка сменилась
+    с прошлого раза, поэтому обычное чтение ленты ничего не пишет в базу.
+    """
+    authors = list(Follow.objects.filter(
+        user=user, author__in=PulledAuthor.objects.values('author')
+    ).values_list('author', flat=True))
+    if not authors:
+        return
+    key = _pull_key(user.pk)
+    since, seen = cache.get(key, (None, {}))
+    marks = cache.get_many([_mark_key(author) for author in authors])
+    marks = {author: marks.get(_mark_key(author)) for author in authors}
+    moved = [author for author in authors
+             if since is None or author not in seen
+             or seen[author] != marks[author]]
+    if not moved:
+        return
+    started = timezone.now()
+    Timeline.objects.bulk_create(
+        _entries(user.pk, _recent_posts(moved, since)),
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True
+    )
+    cache.set(key, (started, marks), None)
+
+
+def demote(author_id):
+    """Снова рассылает посты автора, когда подписчиков стало мало.
+
+    Порог вдвое ниже TIMELINE_FANOUT_LIMIT, чтобы автор на границе
+    не переключался туда и обратно. Посты, которые подписчики ещё
+    не подтянули, дописываются в их ленты.
+    """
+    pulled = PulledAuthor.objects.filter(author_id=author_id)
+    if not pulled.exists():
+        return
+    limit = settings.TIMELINE_FANOUT_LIMIT // 2
+    followers = list(Follow.objects.filter(
+        author_id=author_id
+    ).values_list('user', flat=True)[:limit + 1])
+    if len(followers) > limit:
+        return
+    pulled.delete()
+    pulls = cache.get_many([_pull_key(user_id) for user_id in followers])
+    since = {user_id: pulls.get(_pull_key(user_id), (None,))[0]
+             for user_id in followers}
+    oldest = None
+    if followers and None not in since.values():
+        oldest = min(since.values())
+    posts = list(_recent_posts([author_id], oldest))
+    Timeline.objects.bulk_create(
+        (entry for user_id in followers
+         for entry in _entries(user_id, (
+             row for row in posts
+             if since[user_id] is None or row[2] >= since[user_id]
+         ))),
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True
+    )
+
+
+def follow_feed(user):
+    """Лента подписок: чтение по индексу (user, pub_date, post)."""
+    pull(user)
+    return Post.objects.select_related('author', 'group').filter(
+        timeline__user=user
+    ).annotate(
+        feed_date=F('timeline__pub_date'), feed_post=F('timeline__post')
+    )
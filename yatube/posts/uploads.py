@@ -0,0 +1,89 @@
+import os
+from io import BytesIO
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import InMemoryUploadedFile
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from PIL import Image, ImageOps
+from .constants import MAX_DECODED_PIXELS, MAX_IMAGE_PIXELS, MAX_IMAGE_SIDE
+
+# Форматы, которые пересохраняются; GIF остаётся как есть ради анимации.
+NORMALIZED_FORMATS = {'JPEG': 'JPEG', 'MPO': 'JPEG', 'PNG': 'PNG',
+                      'WEBP': 'WEBP', 'TIFF': 'PNG'}
+EXTENSIONS = {'JPEG': '.jpg', 'PNG': '.png', 'WEBP': '.webp'}
+# Только эти форматы декодируются сразу в уменьшенном масштабе.
+DRAFT_FORMATS = {'JPEG', 'MPO'}
+
+
+class BoundedUploadHandler(TemporaryFileUploadHandler):
+    """Пишет загрузку кусками во временный файл, не держа её в памяти.
+
+    Файл больше IMAGE_UPLOAD_MAX_SIZE дальше не пишется и приходит
+    в форму пустым, так что его отклоняет сама проверка поля.
+    """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.too_large = False
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.too_large:
+            return None
+        if start + len(raw_data) > settings.IMAGE_UPLOAD_MAX_SIZE:
+            self.too_large = True
+            self.file.seek(0)
+            self.file.truncate()
+            return None
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        return super().file_complete(0 if self.too_large else file_size)
+
+
+def normalize_image(upload):
+    """Проверяет картинку по заголовку и пересохраняет её за один проход.
+
+    Число пикселей берётся из заголовка, уже разобранного полем формы,
+    до полного декодирования. JPEG декодируется сразу в уменьшенном
+    масштабе, затем поворачивается по EXIF и сохраняется без метаданных;
+    результат не больше MAX_IMAGE_SIDE по стороне и держится в памяти.
+    Остальные пересохраняемые форматы декодируются целиком, поэтому
+    для них предел ниже — MAX_DECODED_PIXELS.
+    """
+    width, height = upload.image.size
+    limit = MAX_IMAGE_PIXELS
+    if (upload.image.format in NORMALIZED_FORMATS
+            and upload.image.format not in DRAFT_FORMATS):
+        limit = MAX_DECODED_PIXELS
+    if width * height > limit:
+        raise ValidationError(
+            'Слишком большое разрешение картинки: %(pixels)s пикселей.',
+            code='too_many_pixels',
+            params={'pixels': width * height}
+        )
+    upload.seek(0)
+    with Image.open(upload) as image:
+        format_ = NORMALIZED_FORMATS.get(image.format)
+        if format_ is None:
+            upload.seek(0)
+            return upload
+        image.draft('RGB', (MAX_IMAGE_SIDE, MAX_IMAGE_SIDE))
+        icc_profile = image.info.get('icc_profile')
+        image = ImageOps.exif_transpose(image)
+    image.thumbnail((MAX_IMAGE_SIDE, MAX_IMAGE_SIDE))
+    if format_ == 'JPEG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    name, extension = os.path.splitext(upload.name)
+    if Image.registered_extensions().get(extension.lower()) != format_:
+        extension = EXTENSIONS[format_]
+    options = {'icc_profile': icc_profile} if icc_profile else {}
+    if format_ == 'JPEG':
+        options.update(quality=90, progressive=True, optimize=True)
+    buffer = BytesIO()
+    image.save(buffer, format_, **options)
+    upload.close()
+    return InMemoryUploadedFile(
+        buffer, 'image', name + extension, Image.MIME[format_],
+        buffer.tell(), None
+    )
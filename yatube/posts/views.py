@@ -1,63 +1,116 @@
 from django.contrib.auth.decorators import login_required
+from django.http import Http404
 from django.shortcuts import get_object_or_404, render
 from django.shortcuts import redirect
 from django.urls import reverse
-from utils import paginate_page
-from .models import Group, Post, User, Comment, Follow
-from .constants import PER_PAGE
+from django.utils.functional import SimpleLazyObject
+from django.utils.http import urlencode
+from django.views.decorators.http import condition
+from utils import KeysetPaginator, lazy_page, paginate_page
+from . import conditions, feeds
+from .models import Group, Post, User, Follow
+from .caching import (follow_feed_version, group_by_slug,
+                      index_feed_version)
+from .constants import COMMENTS_PER_PAGE, FEED_CACHE_TIMEOUT
+from .counters import user_counters
+from .follows import followed_among
 from .forms import PostForm, CommentForm
+from .pagecache import INDEX_KEY, cache_anonymous_page, post_tags, tagged
+from .profiles import profile_summary
+from .search import search_page
+from .thumbnails import attach_pictures, enqueue_thumbnail
+from .timeline import follow_feed
 
 
+def _followed_on_page(user, page_obj):
+    return followed_among(user, {post.author_id for post in page_obj})
+
+
+@cache_anonymous_page
+@condition(etag_func=conditions.index_etag)
 def index(request):
-    post_list = Post.objects.select_related('group', 'author').all()
-    page_obj = paginate_page(request, post_list)
+    # Лента выбирается, только если её фрагмента нет в кэше.
+    page_obj = lazy_page(request, feeds.index_posts(), attach_pictures)
     template = 'posts/index.html'
     context = {
-        'page_obj': page_obj
+        'page_obj': page_obj,
+        'followed': SimpleLazyObject(
+            lambda: _followed_on_page(request.user, page_obj)
+        ),
+        'feed_version': index_feed_version(request.user),
+        'cache_timeout': FEED_CACHE_TIMEOUT
     }
-    return render(request, template, context)
+    return tagged(render(request, template, context), INDEX_KEY)
 
 
+@cache_anonymous_page
+@condition(etag_func=conditions.group_etag)
 def group_posts(request, slug):
-    group = get_object_or_404(Group, slug=slug)
-    post_list = group.posts.all()
-    page_obj = paginate_page(request, post_list)
+    group = group_by_slug(slug)
+    if group is None:
+        raise Http404
+    page_obj = paginate_page(request, feeds.group_posts(group))
+    attach_pictures(page_obj)
     template = 'posts/group_list.html'
-    posts = group.posts.all()[:PER_PAGE]
     context = {'group': group,
-               'posts': posts,
-               'page_obj': page_obj
+               'posts': page_obj,
+               'page_obj': page_obj,
+               'followed': _followed_on_page(request.user, page_obj)
                }
-    return render(request, template, context)
+    return tagged(render(request, template, context), f'group:{slug}')
 
 
+@cache_anonymous_page
+@condition(etag_func=conditions.profile_etag)
 def profile(request, username):
     template = 'posts/profile.html'
-    author = User.objects.filter(username=username).first()
-    posts = author.posts.all()
-    page_obj = paginate_page(request, posts)
-    user = request.user
-    author = User.objects.get(username=username)
-    following = False
-    if request.user.is_authenticated:
-        following = Follow.objects.filter(user=user, author=author).exists()
-    context = {'author': author,
+    summary = profile_summary(username, request.user)
+    page_obj = paginate_page(request, feeds.author_posts(summary.author))
+    attach_pictures(page_obj)
+    context = {'author': summary.author,
                'page_obj': page_obj,
-               'following': following
+               'following': summary.following,
+               'counters': summary.counters
                }
-    return render(request, template, context)
+    return tagged(render(request, template, context),
+                  f'author:{summary.author.username}')
+
 
+def _comments_page(request, post_id):
+    paginator = KeysetPaginator(feeds.post_comments(post_id),
+                                COMMENTS_PER_PAGE, 'created', window=1)
+    return paginator.get_page(request.GET)
 
+
+@cache_anonymous_page
+@condition(etag_func=conditions.post_etag,
+           last_modified_func=conditions.post_last_modified)
 def post_detail(request, post_id):
     template = 'posts/post_detail.html'
-    post = get_object_or_404(Post, pk=post_id)
+    post = get_object_or_404(
+        Post.objects.select_related('author', 'group', 'author__counters'),
+        pk=post_id
+    )
+    attach_pictures([post])
     form = CommentForm(request.POST or None)
-    comments = Comment.objects.filter(post_id=post_id)
+    comments = _comments_page(request, post_id)
     context = {'post': post,
                'form': form,
                'comments': comments,
+               'counters': user_counters(post.author)
+               }
+    return tagged(render(request, template, context), *post_tags(
+        post.pk, post.author and post.author.username,
+        post.group and post.group.slug
+    ))
+
+
+def post_comments(request, post_id):
+    post = get_object_or_404(Post.objects.only('pk'), pk=post_id)
+    context = {'post': post,
+               'comments': _comments_page(request, post_id)
                }
-    return render(request, template, context)
+    return render(request, 'posts/includes/comment_list.html', context)
 
 
 @login_required
@@ -74,6 +127,7 @@ def post_create(request):
         post = form.save(commit=False)
         post.author = request.user
         post.save()
+        enqueue_thumbnail(post)
         return redirect('posts:profile', username=post.author)
     else:
         return render(request, 'posts/create_post.html', context)
@@ -94,6 +148,8 @@ def post_edit(request, post_id):
         )
         if form.is_valid():
             form.save()
+            if 'image' in form.changed_data:
+                enqueue_thumbnail(post)
             return redirect('posts:post_detail', post_id=post.id)
 
     context = {'form': form,
@@ -121,19 +177,36 @@ def add_comment(request, post_id):
 
 @login_required
 def follow_index(request):
-    posts = Post.objects.filter(author__following__user=request.user)
-    page_obj = paginate_page(request, posts)
-    context = {'page_obj': page_obj}
+    posts = follow_feed(request.user)
+    page_obj = lazy_page(request, posts, attach_pictures, 'feed_date',
+                         'feed_post')
+    context = {'page_obj': page_obj,
+               'feed_version': follow_feed_version(request.user),
+               'cache_timeout': FEED_CACHE_TIMEOUT
+               }
     return render(request, 'posts/follow.html', context=context)
 
 
+def search(request):
+    query = request.GET.get('q', '').strip()
+    posts, cursor = search_page(query, request.GET.get('after'))
+    attach_pictures(posts)
+    context = {'query': query,
+               'posts': posts,
+               'followed': _followed_on_page(request.user, posts),
+               'next_link': cursor and '?' + urlencode(
+                   {'q': query, 'after': cursor}
+               )
+               }
+    return render(request, 'posts/search.html', context)
+
+
 @login_required
 def profile_follow(request, username):
     user = request.user
     author = get_object_or_404(User, username=username)
-    is_follower = Follow.objects.filter(user=user, author=author).exists()
-    if user != author and not is_follower:
-        Follow.objects.create(user=user, author=author)
+    if user != author:
+        Follow.objects.get_or_create(user=user, author=author)
 
     return redirect(reverse('posts:profile',
                     kwargs={'username': author.username}))
@@ -143,9 +216,7 @@ def profile_follow(request, username):
 def profile_unfollow(request, username):
     user = request.user
     author = get_object_or_404(User, username=username)
-    is_follower = Follow.objects.filter(user=user, author=author).exists()
-    if user != author and is_follower:
-        Follow.objects.filter(user=user, author=author).delete()
+    Follow.objects.filter(user=user, author=author).delete()
 
     return redirect(reverse('posts:profile',
                     kwargs={'username': author.username}))
@@ -1,9 +1,236 @@
-from django.core.paginator import Paginator
-from posts.constants import PER_PAGE
+from django.core.paginator import Page, Paginator
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils.encoding import force_bytes, force_text
+from django.utils.http import (urlencode, urlsafe_base64_decode,
+                               urlsafe_base64_encode)
+from posts.constants import MAX_OFFSET_PAGE, PAGE_WINDOW, PER_PAGE
 
+FIRST_PAGE = '?page=1'
 
-def paginate_page(request, posts):
-    paginator = Paginator(posts, PER_PAGE)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
-    return page_obj
+
+def encode_cursor(date, pk):
+    """Упаковывает ключ (дата, id) в непрозрачную строку для URL."""
+    return urlsafe_base64_encode(force_bytes(f'{date.isoformat()}|{pk}'))
+
+
+def decode_cursor(cursor):
+    """Распаковывает курсор; для битого курсора возвращает None."""
+    if not cursor:
+        return None
+    try:
+        date, pk = force_text(urlsafe_base64_decode(cursor)).split('|')
+        date = parse_datetime(date)
+        pk = int(pk)
+    except (ValueError, TypeError, UnicodeDecodeError):
+        return None
+    if date is None:
+        return None
+    return date, pk
+
+
+def older(queryset, key, date_field='pub_date', id_field='pk'):
+    """Записи, которые в ленте идут после ключа (дата, id)."""
+    # Избыточная граница по дате даёт поиск по индексу, а не обход.
+    date, pk = key
+    return queryset.filter(
+        Q(**{f'{date_field}__lte': date}),
+        Q(**{f'{date_field}__lt': date})
+        | Q(**{date_field: date, f'{id_field}__lt': pk})
+    )
+
+
+class KeysetPaginator(Paginator):
+    """Пагинатор по ключу (дата, id) без COUNT(*) и OFFSET.
+
+    Страница ищется по индексу от курсора ?after= (записи старше)
+    или ?before= (записи новее). Вокруг текущей страницы строится
+    окно из PAGE_WINDOW номеров в каждую сторону: для него выбираются
+    только ключи соседних записей, поэтому стоимость любой страницы
+    ограничена и не зависит от её глубины.
+    """
+
+    def __init__(self, object_list, per_page, date_field='pub_date',
+                 id_field='pk', window=PAGE_WINDOW):
+        self.date_field = date_field
+        self.id_field = id_field
+        self.window = window
+        self.links = {}
+        self.previous_link = self.next_link = None
+        self.more_ahead = False
+        self._count = 0
+        self._num_pages = 1
+        super().__init__(
+            object_list.order_by(f'-{date_field}', f'-{id_field}'), per_page
+        )
+
+    @property
+    def count(self):
+        return self._count
+
+    @property
+    def num_pages(self):
+        return self._num_pages
+
+    @property
+    def page_range(self):
+        return sorted(self.links)
+
+    @property
+    def window_links(self):
+        """Тройки (номер, ссылка, разрыв перед номером) окна страниц."""
+        window, previous = [], 0
+        for number, link in sorted(self.links.items()):
+            window.append((number, link, number - previous > 1))
+            previous = number
+        return window
+
+    def _older(self, key):
+        return older(self.object_list, key, self.date_field, self.id_field)
+
+    def _newer(self, key):
+        date, pk = key
+        return self.object_list.filter(
+            Q(**{f'{self.date_field}__gte': date}),
+            Q(**{f'{self.date_field}__gt': date})
+            | Q(**{self.date_field: date, f'{self.id_field}__gt': pk})
+        ).order_by(self.date_field, self.id_field)
+
+    def _key(self, row):
+        return getattr(row, self.date_field), getattr(row, self.id_field)
+
+    def _keys(self, queryset, limit):
+        return list(
+            queryset.values_list(self.date_field, self.id_field)[:limit]
+        )
+
+    def _fetch(self, after, before, number):
+        """Возвращает записи страницы и номер, с которым их открыли."""
+        if after is not None:
+            return list(self._older(after)[:self.per_page]), number
+        if before is not None:
+            rows = list(self._newer(before)[:self.per_page])[::-1]
+            if len(rows) == self.per_page:
+                return rows, number
+            return list(self.object_list[:self.per_page]), 1
+        number = min(number, MAX_OFFSET_PAGE)
+        bottom = (number - 1) * self.per_page
+        rows = list(self.object_list[bottom:bottom + self.per_page])
+        if not rows and number > 1:
+            return list(self.object_list[:self.per_page]), 1
+        return rows, number
+
+    def get_page(self, params):
+        """Возвращает страницу по параметрам запроса (request.GET)."""
+        try:
+            number = max(int(params.get('page', 1)), 1)
+        except (TypeError, ValueError):
+            number = 1
+        after = decode_cursor(params.get('after'))
+        before = decode_cursor(params.get('before'))
+        rows, number = self._fetch(after, before, number)
+        first = last = None
+        behind = ahead = []
+        limit = self.per_page * self.window
+        if rows:
+            first, last = self._key(rows[0]), self._key(rows[-1])
+            if after or before or number > 1:
+                behind = self._keys(self._newer(first), limit + 1)
+            ahead = self._keys(self._older(last), limit + 1)
+        self.more_ahead = len(ahead) > limit
+        ahead = ahead[:limit]
+        pages_behind = -(-len(behind) // self.per_page)
+        if len(behind) <= limit:
+            number = pages_behind + 1
+        else:
+            number = max(number, self.window + 2)
+        self._link_behind(number, first, behind)
+        pages_ahead = self._link_ahead(number, last, ahead)
+
+        self.previous_link = self.links.get(number - 1)
+        self.next_link = self.links.get(number + 1)
+        self._num_pages = number + pages_ahead
+        self._count = (number - 1) * self.per_page + len(rows) + len(ahead)
+        return Page(rows, number, self)
+
+    def _link_behind(self, number, first, behind):
+        self.links = {number: None}
+        pages_behind = -(-len(behind) // self.per_page)
+        for step in range(1, min(pages_behind, self.window) + 1):
+            edge = step * self.per_page
+            if edge >= len(behind):
+                link = FIRST_PAGE
+            elif step == 1:
+                link = self.cursor_link('before', first, number - 1)
+            else:
+                link = self.cursor_link('after', behind[edge], number - step)
+            self.links[number - step] = link
+        if number > 1:
+            self.links.setdefault(1, FIRST_PAGE)
+
+    def _link_ahead(self, number, last, ahead):
+        pages_ahead = -(-len(ahead) // self.per_page)
+        for step in range(1, pages_ahead + 1):
+            edge = last if step == 1 else ahead[(step - 1) * self.per_page - 1]
+            self.links[number + step] = self.cursor_link(
+                'after', edge, number + step
+            )
+        return pages_ahead
+
+    @staticmethod
+    def cursor_link(direction, key, number):
+        """Ссылка на страницу, соседнюю с ключом в направлении direction."""
+        return '?' + urlencode(
+            {direction: encode_cursor(*key), 'page': number}
+        )
+
+
+def paginate_page(request, posts, date_field='pub_date', id_field='pk'):
+    paginator = KeysetPaginator(posts, PER_PAGE, date_field, id_field)
+    return paginator.get_page(request.GET)
+
+
+class LazyRows:
+    """Записи страницы, которые выбираются при первом обращении."""
+
+    def __init__(self, fetch):
+        self._fetch = fetch
+        self._rows = None
+
+    @property
+    def rows(self):
+        if self._rows is None:
+            self._rows = self._fetch()
+        return self._rows
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, index):
+        return self.rows[index]
+
+
+def lazy_page(request, posts, prepare=None, date_field='pub_date',
+              id_field='pk'):
+    """Страница, запросы которой выполняются при первом переборе записей.
+
+    Если фрагмент со страницей взят из кэша, к базе не обращаются.
+    Номер страницы и ссылки пагинатора заполняются вместе с записями,
+    поэтому шаблон должен сначала перебрать записи. prepare получает
+    выбранные записи, например чтобы подставить картинки.
+    """
+    paginator = KeysetPaginator(posts, PER_PAGE, date_field, id_field)
+    page = Page([], 1, paginator)
+
+    def fetch():
+        loaded = paginator.get_page(request.GET)
+        page.number = loaded.number
+        if prepare is not None:
+            prepare(loaded.object_list)
+        return loaded.object_list
+
+    page.object_list = LazyRows(fetch)
+    return page
@@ -105,13 +105,41 @@ MEDIA_URL = '/media/'
 
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+FILE_UPLOAD_HANDLERS = [
+    'posts.uploads.BoundedUploadHandler',
+]
+
+IMAGE_UPLOAD_MAX_SIZE = 20 * 1024 * 1024
+
+# Один файл кэша на узел, общий для всех воркеров; путь можно задать
+# через YATUBE_CACHE_LOCATION. Тесты берут свой файл (core.runner).
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'BACKEND': 'core.cache.SQLiteCache',
+        'LOCATION': os.environ.get(
+            'YATUBE_CACHE_LOCATION', os.path.join(BASE_DIR, 'cache.sqlite3')
+        ),
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+        },
     }
 }
 
+NEAR_CACHE_MAX_ENTRIES = 1000
+NEAR_CACHE_VERSION_TTL = 1
+
+STALE_CACHE_GRACE = 60 * 5
+STALE_CACHE_LOCK_TIMEOUT = 30
+STALE_CACHE_WAIT = 2
+STALE_CACHE_BETA = 1.0
+
+TEST_RUNNER = 'core.runner.TestRunner'
+
 
 INTERNAL_IPS = [
     '127.0.0.1',
-] 
\ No newline at end of file
+] 
+
+TIMELINE_FANOUT_LIMIT = 10000
+
+TIMELINE_BACKFILL_LIMIT = 1000